@@ -0,0 +1,97 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from planner.domain import load_domain
+from planner.problem import Problem
+from planner.search import SearchLimits
+from portal.level import Level
+from portal.planning.planner import ANYTIME_DEADLINE, DOMAIN_PATH
+
+# Loaded once in each worker process rather than once per level
+domain = None
+
+def setup_worker():
+    global domain
+    domain = load_domain(DOMAIN_PATH)
+
+# Level files are turned into planning problems the same way the solver does it; anything else is
+# read as a PDDL problem
+def load_problem(filename):
+    with open(filename, 'r') as f:
+        if os.path.splitext(filename)[1] == '.json':
+            return Level.load(f).planning_problem().planner_problem(domain)[0]
+        return Problem.load(f, domain)
+
+def solve(job):
+    filename, options = job
+    record = { 'file': filename }
+    try:
+        start = time.monotonic()
+        problem = load_problem(filename)
+        loaded = time.monotonic()
+        result = problem.solve(**options)
+        solved = time.monotonic()
+    except Exception as e:
+        record.update({ 'status': 'error', 'error': '%s: %s' % (e.__class__.__name__, e) })
+        return record
+
+    plan = result.plan
+    record.update({
+        'status': result.status,
+        'plan': [str(action) for action in plan] if plan is not None else None,
+        'length': len(plan) if plan is not None else None,
+        'load_time': loaded - start,
+        'solve_time': solved - loaded,
+        'statistics': result.statistics.serialize(),
+    })
+    return record
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+
+    def option(flag, default, parse=str):
+        if flag not in args:
+            return default
+        i = args.index(flag)
+        value = parse(args[i + 1])
+        del args[i:i + 2]
+        return value
+
+    workers = option('-j', os.cpu_count(), int)
+    output = option('-o', None)
+    search = option('-s', 'anytime')
+    heuristic = option('-H', None)
+    deadline = option('-d', ANYTIME_DEADLINE, float)
+    time_limit = option('-t', None, float)
+
+    if search == 'portfolio':
+        sys.exit('batch.py can\'t run the portfolio, which starts a process per search; use solve.py')
+
+    options = { 'search': search, 'limits': SearchLimits(time=time_limit) }
+    if heuristic is not None:
+        options['heuristic'] = heuristic
+    if search == 'anytime':
+        options['deadline'] = deadline
+
+    # So that pddl/*.pddl can be passed as is
+    filenames = [f for f in args[1:] if os.path.abspath(f) != os.path.abspath(DOMAIN_PATH)]
+
+    jobs = [(filename, options) for filename in filenames]
+    out = open(output, 'w') if output else sys.stdout
+    if search == 'parallel':
+        # The search starts its own worker processes, which pool workers aren't allowed to do, so
+        # problems are solved one at a time here instead
+        setup_worker()
+        for record in map(solve, jobs):
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+    else:
+        with multiprocessing.Pool(workers, initializer=setup_worker) as pool:
+            for record in pool.imap(solve, jobs):
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+    if output:
+        out.close()
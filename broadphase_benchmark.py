@@ -0,0 +1,83 @@
+import random
+import sys
+import time
+import tracemalloc
+
+from portal.broadphase import BROAD_PHASES
+from portal.geometry import Position
+from portal.level import Level
+from portal.wall import Wall
+
+# (name, level size, number of walls, longest wall)
+LEVELS = [
+    ('sparse', 2000, 1000, 200),
+    ('dense', 100, 5000, 3),
+]
+
+# Makes a size by size level of random horizontal and vertical walls on whole coordinates
+def generate_walls(rng, size, count, max_length):
+    walls = []
+    for _ in range(count):
+        x = rng.randint(0, size)
+        y = rng.randint(0, size)
+        length = rng.randint(1, max_length)
+        if rng.random() < 0.5:
+            walls.append(Wall((x, y), (min(x + length, size), y) if x < size else (x - length, y)))
+        else:
+            walls.append(Wall((x, y), (x, min(y + length, size)) if y < size else (x, y - length)))
+    return walls
+
+def random_rays(rng, size, count, max_length):
+    rays = []
+    for _ in range(count):
+        p1 = Position(rng.uniform(0, size), rng.uniform(0, size))
+        p2 = Position(p1.x + rng.uniform(-max_length, max_length),
+                      p1.y + rng.uniform(-max_length, max_length))
+        rays.append((p1, p2))
+    return rays
+
+# Returns the time it takes to build a broad phase and the memory it ends up taking, which are
+# measured separately since tracing allocations slows everything down
+def measure_build(name, walls):
+    start = time.perf_counter()
+    BROAD_PHASES[name](walls)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    broad_phase = BROAD_PHASES[name](walls)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory
+
+def measure_queries(level, rays):
+    start = time.perf_counter()
+    for p1, p2 in rays:
+        level.segment_intersects(p1, p2, radius=0.4)
+    return (time.perf_counter() - start) / len(rays)
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    queries = 1000
+    if '-q' in args:
+        i = args.index('-q')
+        queries = int(args[i + 1])
+        del args[i:i + 2]
+
+    seed = 0
+    if '-s' in args:
+        i = args.index('-s')
+        seed = int(args[i + 1])
+        del args[i:i + 2]
+
+    print('%-8s %-6s %10s %10s %12s %12s' % ('level', 'phase', 'build ms', 'memory KB',
+                                             'short ray us', 'long ray us'))
+    for level_name, size, count, max_length in LEVELS:
+        rng = random.Random(seed)
+        walls = generate_walls(rng, size, count, max_length)
+        short_rays = random_rays(rng, size, queries, 5)
+        long_rays = random_rays(rng, size, queries, size)
+        for name in BROAD_PHASES:
+            build_time, memory = measure_build(name, walls)
+            level = Level(walls=walls, broad_phase=name)
+            print('%-8s %-6s %10.1f %10.0f %12.1f %12.1f' % (
+                level_name, name, build_time * 1e3, memory / 1024,
+                measure_queries(level, short_rays) * 1e6, measure_queries(level, long_rays) * 1e6))
@@ -1,5 +1,6 @@
 import math
 import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import ttk
@@ -9,6 +10,9 @@ from portal import tools
 from view import LevelCanvas, LevelView
 from portal.animate import ActionSequence
 from portal.level import Level
+from planner.search import CancellationToken
+
+RUN_POLL_INTERVAL = 100 # ms
 
 class EditorCanvas(LevelCanvas):
     def draw_grid(self):
@@ -46,7 +50,9 @@ class ControlPanel(ttk.Frame):
         self._setup_name()
         self._setup_capabilities()
         self._setup_tools()
-        ttk.Button(self, text='Run', command=self._run).pack(side='bottom')
+        self.run_button = ttk.Button(self, text='Run', command=self._run)
+        self.run_button.pack(side='bottom')
+        self.solver = None
         ttk.Button(self, text='Save', command=self._save).pack(side='bottom')
 
     def _setup_scale(self):
@@ -123,12 +129,36 @@ class ControlPanel(ttk.Frame):
     def _set_tool(self, i):
         self.tool = tools.TOOLS[i](self.canvas, self.level)
 
+    # Solves in a background thread so the editor stays responsive; pressing the button again
+    # while it's running cancels the search
     def _run(self):
-        level = Level.deserialize(self.level.serialize())
-        problem = level.planning_problem()
-        plan = problem.solve(self.remote)
+        if self.solver:
+            self.cancel.cancel()
+            return
 
-        LevelView(level, ActionSequence(level, plan)).start()
+        level = Level.deserialize(self.level.serialize())
+        self.cancel = CancellationToken()
+        self.plan = None
+        def solve():
+            self.plan = level.planning_problem().solve(self.remote, cancel=self.cancel)
+        self.solver = threading.Thread(target=solve, daemon=True)
+        self.solver.start()
+        self.run_button.config(text='Cancel')
+        self.after(RUN_POLL_INTERVAL, lambda: self._finish_run(level))
+
+    def _finish_run(self, level):
+        if self.solver.is_alive():
+            self.after(RUN_POLL_INTERVAL, lambda: self._finish_run(level))
+            return
+
+        self.solver = None
+        self.run_button.config(text='Run')
+        if self.cancel.cancelled:
+            return
+        if self.plan is not None:
+            LevelView(level, ActionSequence(level, self.plan)).start()
+        else:
+            print('no plan found')
 
     def _save(self):
         path = filedialog.asksaveasfilename(
@@ -1,5 +1,5 @@
 from planner import utils
-from planner.logic import Expression
+from planner.logic import Expression, PredicateInstance, Not, FALSE, generators
 from planner.value import Binding
 
 class Action:
@@ -8,10 +8,21 @@ class Action:
         self.parameters = parameters
         self.precondition = precondition
         self.effect = effect
+        self.generators = generators(parameters, precondition)
 
     def instantiate(self, args):
         return ActionInstance(self, args)
 
+    # Yields a GroundAction for every binding of our parameters whose precondition isn't trivially
+    # false. Bindings that don't match the static facts in our precondition are skipped outright.
+    def ground(self, problem):
+        for env in problem.bindings(self.parameters, self.generators):
+            precondition = self.precondition.ground(problem, env)
+            if precondition is not FALSE:
+                effect = self.effect.ground(problem, env)
+                yield GroundAction(self, [env[p] for p in self.parameters], precondition, effect,
+                                   problem.atoms)
+
     @staticmethod
     def deserialize(expr, domain):
         action_name = utils.get_arg(expr, ':action')
@@ -40,3 +51,52 @@ class ActionInstance:
 
     def __repr__(self):
         return '(%s %s)' % (self.action.name, ' '.join([a.name for a in self.args]))
+
+
+class GroundAction(ActionInstance):
+    def __init__(self, action, args, precondition, effect, atoms):
+        super().__init__(action, args)
+        # Split the precondition into the atoms that must hold, the atoms that must not hold, and
+        # whatever's left over (e.g. disjunctions) that has to be tested the slow way
+        self.positive = set()
+        self.negative = set()
+        self.conditions = []
+        for expr in precondition.conjuncts():
+            if isinstance(expr, PredicateInstance):
+                self.positive.add(expr)
+            elif isinstance(expr, Not) and isinstance(expr.arg, PredicateInstance):
+                self.negative.add(expr.arg)
+            else:
+                self.conditions.append(expr)
+        self.positive = frozenset(self.positive)
+        self.negative = frozenset(self.negative)
+
+        self.add_effects = frozenset(e for e in effect.conjuncts()
+                                     if isinstance(e, PredicateInstance))
+        self.del_effects = frozenset(e.arg for e in effect.conjuncts() if isinstance(e, Not))
+
+        self.positive_mask = atoms.mask(self.positive)
+        self.negative_mask = atoms.mask(self.negative)
+        self.add_mask = atoms.mask(self.add_effects)
+        self.del_mask = atoms.mask(self.del_effects)
+        # When every deleted atom holds and no added atom does (the usual case), applying this
+        # action flips exactly these atoms, so the change to the state's hash is a constant
+        self.hash_delta = (atoms.hash(self.add_mask | self.del_mask)
+                           if not self.add_mask & self.del_mask else None)
+
+        # Compiled precondition, takes a packed state
+        self.test = precondition.compile(atoms)
+
+    def applicable(self, state):
+        return self.test(state.bits)
+
+    # Unlike ActionInstance.apply, this works on packed states and returns the successor
+    def apply(self, bits):
+        return (bits & ~self.del_mask) | self.add_mask
+
+    # Returns what to xor into a state's hash to get the hash of its successor
+    def hash_change(self, bits, successor, atoms):
+        if (self.hash_delta is not None and not bits & self.add_mask and
+                bits & self.del_mask == self.del_mask):
+            return self.hash_delta
+        return atoms.hash(bits ^ successor)
@@ -0,0 +1,73 @@
+import random
+from collections import defaultdict
+
+
+# Gives each ground atom a dense integer id so that sets of atoms can be packed into an int.
+#
+# Each atom also gets a random 64-bit Zobrist key. The hash of a packed state is the xor of the keys
+# of its atoms, so it can be updated incrementally as atoms are added and removed.
+class AtomTable:
+    def __init__(self, seed=0):
+        self.ids = {}
+        self.atoms = []
+        self.keys = []
+        self.random = random.Random(seed)
+
+    def id(self, atom):
+        atom_id = self.ids.get(atom)
+        if atom_id is None:
+            atom_id = len(self.atoms)
+            self.ids[atom] = atom_id
+            self.atoms.append(atom)
+            self.keys.append(self.random.getrandbits(64))
+        return atom_id
+
+    def hash(self, bits):
+        state_hash = 0
+        while bits:
+            low = bits & -bits
+            state_hash ^= self.keys[low.bit_length() - 1]
+            bits ^= low
+        return state_hash
+
+    def mask(self, atoms):
+        bits = 0
+        for atom in atoms:
+            bits |= 1 << self.id(atom)
+        return bits
+
+    def holds(self, atom, bits):
+        atom_id = self.ids.get(atom)
+        return atom_id is not None and (bits >> atom_id) & 1 == 1
+
+    def unpack(self, bits):
+        atoms = []
+        while bits:
+            low = bits & -bits
+            atoms.append(self.atoms[low.bit_length() - 1])
+            bits ^= low
+        return atoms
+
+    def __len__(self):
+        return len(self.atoms)
+
+
+# Looks up the facts of a predicate that match some of its arguments.
+#
+# A pattern has one entry per predicate argument, either the value it has to match or None. Tables
+# for each combination of bound argument positions are built the first time they're used.
+class FactIndex:
+    def __init__(self, facts):
+        self.facts = list(facts)
+        self.tables = {}
+
+    def matching(self, predicate, pattern):
+        positions = tuple(i for i, value in enumerate(pattern) if value is not None)
+        table = self.tables.get((predicate, positions))
+        if table is None:
+            table = defaultdict(list)
+            for fact in self.facts:
+                if fact.predicate is predicate:
+                    table[tuple(fact.args[i] for i in positions)].append(fact)
+            self.tables[(predicate, positions)] = table
+        return table.get(tuple(pattern[i] for i in positions), ())
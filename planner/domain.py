@@ -1,6 +1,9 @@
-import sexpdata
+import hashlib
+import io
+import os
+import pickle
 
-from planner import utils
+from planner import pddl, utils
 from planner.actions import Action
 from planner.value import Value, Type
 from planner.logic import Predicate
@@ -12,11 +15,19 @@ class Domain:
         self.constants = constants or []
         self.predicates = predicates or {}
         self.actions = actions or {}
+        self.classify_predicates()
+
+    # Predicates that no action ever adds or deletes are static: their truth is fixed by the
+    # problem's initial state, so they never need to be part of a search state
+    def classify_predicates(self):
+        changed = set(atom.predicate for action in self.actions.values()
+                      for atom in action.effect.atoms())
+        self.static_predicates = set(p for p in self.predicates.values() if p not in changed)
+        self.fluent_predicates = set(p for p in self.predicates.values() if p in changed)
 
     @staticmethod
     def load(f):
-        data = utils.desymbolize(sexpdata.load(f))
-        return Domain.deserialize(data)
+        return Domain.deserialize(pddl.load(f))
 
     @staticmethod
     def deserialize(expr):
@@ -34,6 +45,7 @@ class Domain:
             elif form[0] == ':action':
                 action = Action.deserialize(form, domain)
                 domain.actions[action.name] = action
+        domain.classify_predicates()
         return domain
 
     @staticmethod
@@ -65,3 +77,73 @@ class Domain:
             arg_types = [domain.types[arg_type] for arg_name, arg_type in utils.typed_ids(predicate[1:])]
             predicates[predicate_name] = Predicate(predicate_name, arg_types)
         return predicates
+
+
+# Hash of the planner package's source, see planner_version
+_planner_version = None
+
+# Domains loaded by load_domain, by path: (modification time and size, source, Domain or None)
+_loaded_domains = {}
+
+# Returns the text of the domain file at path, only re-reading it if the file changed
+def domain_source(path):
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    entry = _loaded_domains.get(path)
+    if entry is None or entry[0] != stamp:
+        with open(path, 'r') as f:
+            entry = (stamp, f.read(), None)
+        _loaded_domains[path] = entry
+    return entry[1]
+
+# Returns a hash of the source files of the planner package. Unpickling doesn't run __init__, so a
+# pickled domain is only safe to load with the exact code that pickled it.
+def planner_version():
+    global _planner_version
+    if _planner_version is None:
+        digest = hashlib.sha256()
+        package = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(package)):
+            if name.endswith('.py'):
+                digest.update(name.encode())
+                with open(os.path.join(package, name), 'rb') as f:
+                    digest.update(f.read())
+        _planner_version = digest.hexdigest()[:16]
+    return _planner_version
+
+# Like Domain.load, but the parsed domain is kept for the rest of the process and pickled to a
+# __pycache__ directory next to the file, under the hash of its contents and of the planner's
+# code, so later processes can skip parsing it too. The returned Domain is shared, so it mustn't
+# be modified.
+def load_domain(path):
+    source = domain_source(path)
+    stamp, _, domain = _loaded_domains[path]
+    if domain is None:
+        digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+        cache_path = os.path.join(os.path.dirname(path), '__pycache__', '%s.%s.%s.pickle' % (
+            os.path.basename(path), digest, planner_version()))
+        domain = read_cached_domain(cache_path)
+        if domain is None:
+            domain = Domain.load(io.StringIO(source))
+            write_cached_domain(cache_path, domain)
+        _loaded_domains[path] = (stamp, source, domain)
+    return domain
+
+def read_cached_domain(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # Missing, half written or from incompatible code; parsing again will replace it
+        return None
+
+def write_cached_domain(cache_path, domain):
+    temp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            pickle.dump(domain, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization, e.g. the directory may be read-only
+        pass
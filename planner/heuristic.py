@@ -0,0 +1,172 @@
+import heapq
+
+from planner.logic import PredicateInstance, Not, And, Or
+
+INFINITY = float('inf')
+
+
+# Base class for delete-relaxation heuristics over a grounded problem.
+#
+# Every precondition (and the goal) is relaxed into a list of conditions, where each condition is a
+# tuple of atom ids and is satisfied as soon as any one of its atoms is reached. Negative literals
+# are ignored, which is what makes this a relaxation.
+class RelaxedHeuristic:
+    def __init__(self, problem):
+        self.problem = problem
+        self.actions = problem.ground()
+        atoms = problem.atoms
+
+        self.conditions = [self.relax_all(atoms, [*a.positive, *a.conditions]) for a in self.actions]
+        self.goal_conditions = self.relax_all(atoms, problem.ground_goal.conjuncts())
+        self.effects = [[atoms.id(atom) for atom in a.add_effects] for a in self.actions]
+
+        # The goal is treated as an extra action (with index len(actions)) that has no effects
+        self.goal_index = len(self.actions)
+        all_conditions = self.conditions + [self.goal_conditions]
+        self.watchers = [[] for _ in range(len(atoms))]
+        for action_index, conditions in enumerate(all_conditions):
+            for condition_index, condition in enumerate(conditions):
+                for atom_id in condition:
+                    self.watchers[atom_id].append((action_index, condition_index))
+        self.unconditional = [i for i, conditions in enumerate(all_conditions) if not conditions]
+
+    def relax_all(self, atoms, exprs):
+        conditions = []
+        for expr in exprs:
+            conditions.extend(self.relax(atoms, expr))
+        return conditions
+
+    def relax(self, atoms, expr):
+        if isinstance(expr, PredicateInstance):
+            return [(atoms.id(expr),)]
+        elif isinstance(expr, Not):
+            return []
+        elif isinstance(expr, And):
+            return self.relax_all(atoms, expr.args)
+        elif isinstance(expr, Or):
+            # Keep one condition from each disjunct; if any disjunct is free, so is the whole thing
+            condition = []
+            for arg in expr.args:
+                arg_conditions = self.relax(atoms, arg)
+                if not arg_conditions:
+                    return []
+                condition.extend(arg_conditions[0])
+            return [tuple(condition)]
+        else:
+            raise Exception('cannot relax %s' % expr)
+
+    def combine(self, total, cost):
+        raise NotImplementedError('combine not implemented for %s' % self.__class__.__name__)
+
+    # Generalized Dijkstra over the relaxed problem. Returns the cost of the goal (or INFINITY if
+    # it's unreachable), along with the data needed to extract a relaxed plan.
+    def explore(self, bits):
+        num_atoms = len(self.watchers)
+        costs = [INFINITY] * num_atoms
+        supporters = [None] * num_atoms
+        remaining = [len(c) for c in self.conditions] + [len(self.goal_conditions)]
+        action_costs = [0] * len(remaining)
+        achieved_by = {}
+
+        frontier = []
+        for atom_id in range(min(bits.bit_length(), num_atoms)):
+            if (bits >> atom_id) & 1:
+                costs[atom_id] = 0
+                frontier.append((0, atom_id))
+
+        def fire(action_index):
+            if action_index == self.goal_index:
+                return True
+            cost = action_costs[action_index] + 1
+            for atom_id in self.effects[action_index]:
+                if cost < costs[atom_id]:
+                    costs[atom_id] = cost
+                    supporters[atom_id] = action_index
+                    heapq.heappush(frontier, (cost, atom_id))
+            return False
+
+        for action_index in self.unconditional:
+            if fire(action_index):
+                return 0, costs, supporters, achieved_by
+
+        while frontier:
+            cost, atom_id = heapq.heappop(frontier)
+            if cost > costs[atom_id]:
+                continue
+            for action_index, condition_index in self.watchers[atom_id]:
+                key = (action_index, condition_index)
+                if key in achieved_by:
+                    continue
+                # Atoms come off the queue in cost order, so the first atom to satisfy a
+                # disjunctive condition is also its cheapest
+                achieved_by[key] = atom_id
+                action_costs[action_index] = self.combine(action_costs[action_index], cost)
+                remaining[action_index] -= 1
+                if remaining[action_index] == 0 and fire(action_index):
+                    return action_costs[self.goal_index], costs, supporters, achieved_by
+        return INFINITY, costs, supporters, achieved_by
+
+    # Estimates the cost of reaching the goal from a packed state
+    def evaluate(self, bits):
+        return self.explore(bits)[0]
+
+    def __call__(self, state):
+        return self.evaluate(state.bits)
+
+
+class AdditiveHeuristic(RelaxedHeuristic):
+    def combine(self, total, cost):
+        return total + cost
+
+
+class MaxHeuristic(RelaxedHeuristic):
+    def combine(self, total, cost):
+        return max(total, cost)
+
+
+class FFHeuristic(AdditiveHeuristic):
+    # Counts the actions in a relaxed plan extracted from the h_add best supporters
+    def evaluate(self, bits):
+        cost, costs, supporters, achieved_by = self.explore(bits)
+        if cost == INFINITY:
+            return INFINITY
+
+        relaxed_plan = set()
+        open_atoms = [achieved_by[(self.goal_index, i)] for i in range(len(self.goal_conditions))]
+        seen = set(open_atoms)
+        while open_atoms:
+            atom_id = open_atoms.pop()
+            action_index = supporters[atom_id]
+            if costs[atom_id] == 0 or action_index in relaxed_plan:
+                continue
+            relaxed_plan.add(action_index)
+            for i in range(len(self.conditions[action_index])):
+                precondition = achieved_by[(action_index, i)]
+                if precondition not in seen:
+                    seen.add(precondition)
+                    open_atoms.append(precondition)
+        return len(relaxed_plan)
+
+
+# Remembers the estimates of another heuristic, for when several searches over the same problem
+# evaluate the same states (see planner.search.AnytimeSearch).
+class CachedHeuristic:
+    def __init__(self, heuristic):
+        self.heuristic = heuristic
+        self.estimates = {}
+
+    def evaluate(self, bits):
+        estimate = self.estimates.get(bits)
+        if estimate is None:
+            estimate = self.estimates[bits] = self.heuristic.evaluate(bits)
+        return estimate
+
+    def __call__(self, state):
+        return self.evaluate(state.bits)
+
+
+HEURISTICS = {
+    'add': AdditiveHeuristic,
+    'max': MaxHeuristic,
+    'ff': FFHeuristic,
+}
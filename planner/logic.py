@@ -9,6 +9,32 @@ class Expression:
     def apply(self, fluents, env={}):
         raise NotImplementedError('apply not implemented for %s' % self.__class__.__name__)
 
+    # Returns an equivalent variable-free expression in negation normal form, with quantifiers
+    # unrolled over the problem's objects and trivially true/false parts simplified away
+    def ground(self, problem, env={}):
+        raise NotImplementedError('ground not implemented for %s' % self.__class__.__name__)
+
+    # Only defined for ground expressions
+    def negate(self):
+        raise NotImplementedError('negate not implemented for %s' % self.__class__.__name__)
+
+    def conjuncts(self):
+        return [self]
+
+    # Yields every predicate instance mentioned in this expression
+    def atoms(self):
+        raise NotImplementedError('atoms not implemented for %s' % self.__class__.__name__)
+
+    # Only defined for ground expressions. Returns Python source for a boolean expression over
+    # `bits`, a state packed with the given AtomTable.
+    def source(self, atoms):
+        raise NotImplementedError('source not implemented for %s' % self.__class__.__name__)
+
+    # Turns a ground expression into a flat function of a packed state, so testing it doesn't
+    # need to walk the expression tree
+    def compile(self, atoms):
+        return eval('lambda bits: %s' % self.source(atoms))
+
     @staticmethod
     def deserialize(expr, domain, env):
         op = expr[0]
@@ -51,13 +77,28 @@ class PredicateInstance(Expression):
         self.args = tuple(args)
 
     def test(self, state, env={}):
-        if not state.fluents:
-            import ipdb; ipdb.set_trace()
-        return self.substitute(env) in state.fluents
+        if not env:
+            return state.holds(self)
+        return state.holds(self.substitute(env))
 
     def apply(self, fluents, env={}):
         fluents.add(self.substitute(env))
 
+    def ground(self, problem, env={}):
+        atom = self.substitute(env)
+        if self.predicate in problem.domain.static_predicates:
+            return TRUE if atom in problem.static_facts else FALSE
+        return atom
+
+    def atoms(self):
+        yield self
+
+    def source(self, atoms):
+        return 'bits & %d' % (1 << atoms.id(self))
+
+    def negate(self):
+        return Not(self)
+
     def substitute(self, env):
         return PredicateInstance(self.predicate, [arg.substitute(env) for arg in self.args])
 
@@ -91,6 +132,29 @@ class And(Expression):
         for arg in self.args:
             arg.apply(fluents, env)
 
+    def ground(self, problem, env={}):
+        return conjunction([arg.ground(problem, env) for arg in self.args])
+
+    def negate(self):
+        return disjunction([arg.negate() for arg in self.args])
+
+    def conjuncts(self):
+        return list(self.args)
+
+    def atoms(self):
+        for arg in self.args:
+            yield from arg.atoms()
+
+    def source(self, atoms):
+        positive, negative, rest = split_literals(self.args, atoms)
+        terms = []
+        if positive:
+            terms.append('(bits & %d) == %d' % (positive, positive))
+        if negative:
+            terms.append('not bits & %d' % negative)
+        terms.extend('(%s)' % arg.source(atoms) for arg in rest)
+        return ' and '.join(terms) if terms else 'True'
+
     def __repr__(self):
         return '(and %s)' % ' '.join([str(a) for a in self.args])
 
@@ -110,6 +174,26 @@ class Or(Expression):
                 return True
         return False
 
+    def ground(self, problem, env={}):
+        return disjunction([arg.ground(problem, env) for arg in self.args])
+
+    def negate(self):
+        return conjunction([arg.negate() for arg in self.args])
+
+    def atoms(self):
+        for arg in self.args:
+            yield from arg.atoms()
+
+    def source(self, atoms):
+        positive, negative, rest = split_literals(self.args, atoms)
+        terms = []
+        if positive:
+            terms.append('bits & %d' % positive)
+        if negative:
+            terms.append('(bits & %d) != %d' % (negative, negative))
+        terms.extend('(%s)' % arg.source(atoms) for arg in rest)
+        return ' or '.join(terms) if terms else 'False'
+
     def __repr__(self):
         return '(or %s)' % ' '.join([str(a) for a in self.args])
 
@@ -130,6 +214,18 @@ class Not(Expression):
         assert(isinstance(self.arg, PredicateInstance))
         fluents.discard(self.arg.substitute(env))
 
+    def ground(self, problem, env={}):
+        return self.arg.ground(problem, env).negate()
+
+    def negate(self):
+        return self.arg
+
+    def atoms(self):
+        return self.arg.atoms()
+
+    def source(self, atoms):
+        return 'not (%s)' % self.arg.source(atoms)
+
     def __repr__(self):
         return '(not %s)' % str(self.arg)
 
@@ -148,6 +244,14 @@ class Implies(Expression):
     def test(self, state, env={}):
         return (not self.left.test(state, env)) or self.right.test(state, env)
 
+    def ground(self, problem, env={}):
+        return disjunction([self.left.ground(problem, env).negate(),
+                            self.right.ground(problem, env)])
+
+    def atoms(self):
+        yield from self.left.atoms()
+        yield from self.right.atoms()
+
     def __repr__(self):
         return '(imply %s %s)' % (str(self.left), str(self.right))
 
@@ -163,14 +267,22 @@ class Exists(Expression):
     def __init__(self, vars, expr):
         self.vars = vars
         self.expr = expr
+        # Only bindings that match a fact for each of these atoms can make expr true
+        self.generators = generators(vars, expr)
 
     def test(self, state, env={}):
-        for binding in state.possible_bindings([v.type for v in self.vars]):
-            new_env = {**env, **dict(zip(self.vars, binding))}
+        for new_env in state.bindings(self.vars, self.generators, env):
             if self.expr.test(state, new_env):
                 return True
         return False
 
+    def ground(self, problem, env={}):
+        return disjunction([self.expr.ground(problem, new_env)
+                            for new_env in problem.bindings(self.vars, self.generators, env)])
+
+    def atoms(self):
+        return self.expr.atoms()
+
     def __repr__(self):
         return '(exists (%s) %s)' % (' '.join(v.name for v in self.vars), str(self.expr))
 
@@ -188,14 +300,23 @@ class Forall(Expression):
     def __init__(self, vars, expr):
         self.vars = vars
         self.expr = expr
+        # An implication is trivially true for bindings that don't match its antecedent, so only
+        # those that do need to be checked
+        self.generators = generators(vars, expr.left) if isinstance(expr, Implies) else []
 
     def test(self, state, env={}):
-        for binding in state.possible_bindings([v.type for v in self.vars]):
-            new_env = {**env, **dict(zip(self.vars, binding))}
+        for new_env in state.bindings(self.vars, self.generators, env):
             if not self.expr.test(state, new_env):
                 return False
         return True
 
+    def ground(self, problem, env={}):
+        return conjunction([self.expr.ground(problem, new_env)
+                            for new_env in problem.bindings(self.vars, self.generators, env)])
+
+    def atoms(self):
+        return self.expr.atoms()
+
     def __repr__(self):
         return '(forall (%s) %s)' % (' '.join(v.name for v in self.vars), str(self.expr))
 
@@ -217,6 +338,12 @@ class Equal(Expression):
     def test(self, state, env={}):
         return self.left.substitute(env) == self.right.substitute(env)
 
+    def ground(self, problem, env={}):
+        return TRUE if self.test(None, env) else FALSE
+
+    def atoms(self):
+        return iter(())
+
     def __repr__(self):
         return '(= %s %s)' % (str(self.left), str(self.right))
 
@@ -227,3 +354,72 @@ class Equal(Expression):
         left = env[expr[1]]
         right = env[expr[2]]
         return Equal(left, right)
+
+
+# The empty conjunction and disjunction double as the constants true and false in ground expressions
+TRUE = And()
+FALSE = Or()
+
+def conjunction(args):
+    flattened = []
+    for arg in args:
+        if arg is FALSE:
+            return FALSE
+        flattened.extend(arg.args if isinstance(arg, And) else [arg])
+    if len(flattened) == 1:
+        return flattened[0]
+    return And(*flattened) if flattened else TRUE
+
+def disjunction(args):
+    flattened = []
+    for arg in args:
+        if arg is TRUE:
+            return TRUE
+        flattened.extend(arg.args if isinstance(arg, Or) else [arg])
+    if len(flattened) == 1:
+        return flattened[0]
+    return Or(*flattened) if flattened else FALSE
+
+# Packs the atoms and negated atoms among args into masks, and returns the remaining args as-is
+def split_literals(args, atoms):
+    positive = 0
+    negative = 0
+    rest = []
+    for arg in args:
+        if isinstance(arg, PredicateInstance):
+            positive |= 1 << atoms.id(arg)
+        elif isinstance(arg, Not) and isinstance(arg.arg, PredicateInstance):
+            negative |= 1 << atoms.id(arg.arg)
+        else:
+            rest.append(arg)
+    return positive, negative, rest
+
+# Returns the atoms that expr requires to be true which mention any of vars
+def generators(vars, expr):
+    if isinstance(expr, PredicateInstance):
+        return [expr] if any(arg in vars for arg in expr.args) else []
+    elif isinstance(expr, And):
+        return [atom for arg in expr.args for atom in generators(vars, arg)]
+    return []
+
+# Yields an extension of env binding each of vars, for every way of matching all the generator
+# atoms against the facts in index. Variables that don't appear in any generator are bound to every
+# object of the right type.
+def matching_bindings(vars, generators, env, index, problem):
+    if generators:
+        atom = generators[0]
+        pattern = [None if isinstance(value, Binding) else value
+                   for value in (arg.substitute(env) for arg in atom.args)]
+        for fact in index.matching(atom.predicate, pattern):
+            new_env = dict(env)
+            for arg, expected, value in zip(atom.args, pattern, fact.args):
+                if expected is None:
+                    if new_env.get(arg, value) is not value or not value.belongs_to(arg.type):
+                        break
+                    new_env[arg] = value
+            else:
+                yield from matching_bindings(vars, generators[1:], new_env, index, problem)
+    else:
+        free = [v for v in vars if v not in env]
+        for binding in problem.possible_bindings([v.type for v in free]):
+            yield {**env, **dict(zip(free, binding))}
@@ -0,0 +1,53 @@
+import io
+import re
+
+# A token is a parenthesis, a comment (which runs to the end of the line) or a name. Names can't
+# contain whitespace, so a token never spans a newline.
+TOKEN = re.compile(r';[^\n]*|[()]|[^\s();]+')
+
+CHUNK_SIZE = 1 << 16
+
+# Reads the first s-expression in a PDDL file into nested lists of strings. The file is tokenized
+# a chunk at a time, so big problems never have to be held in memory as text.
+def load(f):
+    stack = []
+    for tokens in chunk_tokens(f):
+        for token in tokens:
+            if token == '(':
+                stack.append([])
+            elif token == ')':
+                if not stack:
+                    raise Exception('Unbalanced ) in PDDL')
+                expr = stack.pop()
+                if not stack:
+                    return expr
+                stack[-1].append(expr)
+            elif token[0] == ';':
+                continue
+            elif stack:
+                stack[-1].append(token)
+            else:
+                raise Exception('Unexpected %s outside of any PDDL expression' % token)
+    raise Exception('Unexpected end of PDDL' if stack else 'No PDDL expression found')
+
+def loads(s):
+    return load(io.StringIO(s))
+
+# Yields a list of tokens for each chunk of f. Tokens can't span whitespace or parentheses, so
+# chunks are cut after the last of those, unless that's in a comment on the chunk's last line, in
+# which case the cut comes just before the comment.
+def chunk_tokens(f):
+    rest = ''
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            yield TOKEN.findall(rest)
+            return
+        chunk = rest + chunk
+        cut = chunk.find(';', chunk.rfind('\n') + 1)
+        if cut == -1:
+            cut = len(chunk)
+            while cut and not (chunk[cut - 1].isspace() or chunk[cut - 1] in '()'):
+                cut -= 1
+        rest = chunk[cut:]
+        yield TOKEN.findall(chunk, 0, cut)
@@ -1,11 +1,15 @@
 from collections import defaultdict
 
-import sexpdata
-
-from planner import utils
+from planner import pddl, utils
+from planner.atoms import AtomTable, FactIndex
 from planner.value import Value
-from planner.logic import Expression, PredicateInstance
-from planner.search import ForwardSearch
+from planner.logic import Expression, PredicateInstance, matching_bindings
+from planner.search import BLIND_SEARCHES, SEARCHES, SuccessorGenerator
+from planner.vectorized import VectorizedSearch
+
+# planner.vectorized builds on planner.search, so its search is registered here rather than there
+SEARCHES['vectorized'] = VectorizedSearch
+BLIND_SEARCHES += (VectorizedSearch,)
 
 class Problem:
     def __init__(self, name, domain, objects, init, goal):
@@ -14,6 +18,15 @@ class Problem:
         self.objects = objects
         self.init = init
         self.goal = goal
+        self.static_facts = frozenset(atom for atom in init
+                                      if atom.predicate in domain.static_predicates)
+        self.initial_fluents = [atom for atom in init if atom not in self.static_facts]
+        self.static_index = FactIndex(self.static_facts)
+        self.atoms = AtomTable()
+        self.ground_actions = None
+        self.ground_goal = None
+        self.goal_test = None
+        self.successor_generator = None
         self.cache_objects_of_type()
 
     def cache_objects_of_type(self):
@@ -24,13 +37,67 @@ class Problem:
                 self.objects_of_type[typ].append(obj)
                 typ = typ.parent
 
-    def plan(self):
-        return ForwardSearch(self).search()
+    # Destructively mutates accumulated return value after yielding
+    def possible_bindings(self, binding_types, acc=None):
+        if acc is None:
+            acc = []
+        if not binding_types:
+            yield acc
+        else:
+            for obj in self.objects_of_type[binding_types[0]]:
+                acc.append(obj)
+                for b in self.possible_bindings(binding_types[1:], acc):
+                    yield b
+                acc.pop()
+
+    # Yields extensions of env binding vars that are consistent with the static facts. Only static
+    # generators can be used here since the fluents depend on the state.
+    def bindings(self, vars, generators, env={}):
+        static_generators = [atom for atom in generators
+                             if atom.predicate in self.domain.static_predicates]
+        return matching_bindings(vars, static_generators, env, self.static_index, self)
+
+    # Instantiates every action once up front so the search doesn't have to keep re-binding them
+    def ground(self):
+        if self.ground_actions is None:
+            self.ground_actions = [ground_action
+                                   for action in self.domain.actions.values()
+                                   for ground_action in action.ground(self)]
+            for action_id, ground_action in enumerate(self.ground_actions):
+                ground_action.id = action_id
+            self.ground_goal = self.goal.ground(self)
+            self.goal_test = self.ground_goal.compile(self.atoms)
+            self.successor_generator = SuccessorGenerator(self.ground_actions)
+        return self.ground_actions
+
+    # search is one of the names in planner.search.SEARCHES. heuristic (a name from
+    # planner.heuristic.HEURISTICS) only applies to the heuristic searches, weight to weighted A*
+    # and deadline to anytime search. hooks maps the names of search hooks (see ForwardSearch) to
+    # callbacks. Returns a planner.search.SearchResult; see ForwardSearch.run for limits and cancel.
+    def solve(self, search='bfs', heuristic=None, weight=None, limits=None, cancel=None,
+              deadline=None, hooks=None):
+        search_cls = SEARCHES[search]
+        options = {}
+        if search_cls not in BLIND_SEARCHES:
+            options['heuristic'] = heuristic
+        if weight is not None:
+            options['weight'] = weight
+        if deadline is not None:
+            options['deadline'] = deadline
+        search = search_cls(self, **options)
+        for name, hook in (hooks or {}).items():
+            if not hasattr(search, name):
+                raise Exception('%s does not support the %s hook' % (search_cls.__name__, name))
+            setattr(search, name, hook)
+        return search.run(limits, cancel)
+
+    def plan(self, search='bfs', heuristic=None, weight=None, limits=None, cancel=None,
+             deadline=None, hooks=None):
+        return self.solve(search, heuristic, weight, limits, cancel, deadline, hooks).plan
 
     @staticmethod
     def load(f, domain):
-        data = utils.desymbolize(sexpdata.load(f))
-        return Problem.deserialize(data, domain)
+        return Problem.deserialize(pddl.load(f), domain)
 
     @staticmethod
     def deserialize(expr, domain):
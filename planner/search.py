@@ -1,97 +1,812 @@
-from collections import deque
+import heapq
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict, deque
 
+from planner.atoms import FactIndex
+from planner.heuristic import CachedHeuristic, HEURISTICS, INFINITY
+from planner.logic import matching_bindings
+
+# Blind breadth-first search. Searches work on packed states and refer to them by their id in a
+# StateRegistry, rather than keeping node objects around.
+#
+# Profilers and progress displays can set any of these hooks, which cost next to nothing when
+# they're left as None:
+# - on_expand(state_id) is called before a state is expanded
+# - on_generate(state_id, parent_id, action) is called for every newly registered state
+# - on_solution(plan) is called with the plan when one is found
 class ForwardSearch:
     def __init__(self, problem):
         self.problem = problem
+        self.statistics = SearchStatistics()
         self.start = SearchState.from_problem(problem)
-        self.goal = problem.goal
+        self.actions = self.statistics.time_phase('ground', problem.ground)
+        self.successor_generator = problem.successor_generator
+        self.goal_test = problem.goal_test
 
+        self.registry = StateRegistry.for_problem(problem)
         self.frontier = deque()
-        self.explored = set()
+        self.limits = SearchLimits()
+        self.cancel = None
+        self.stopped = None
+
+        self.on_expand = None
+        self.on_generate = None
+        self.on_solution = None
 
     def search(self):
-        self.frontier.append(SearchNode(self.start))
-        for node in self.explore_nodes():
-            if node.state.satisfies(self.goal):
-                return node.history()
-            self.expand_node(node)
-        return None
+        return self.run().plan
+
+    # Like search, but stops early once any of limits is reached or cancel is cancelled, and
+    # returns a SearchResult
+    def run(self, limits=None, cancel=None):
+        self.limits = limits or SearchLimits()
+        self.cancel = cancel
+        self.statistics.start()
+        self.push_node(self.register(self.start.bits, self.registry.key(self.start.bits)))
+        for state_id in self.explore_nodes():
+            if self.goal_test(self.registry.states[state_id]):
+                plan = self.statistics.time_phase('extract', self.extract_plan, state_id)
+                return self.result(SearchResult.SOLVED, plan)
+            self.expand_node(state_id)
+        return self.result(self.stopped or SearchResult.UNSOLVABLE)
+
+    def extract_plan(self, state_id):
+        return [self.actions[action_id] for action_id in self.registry.path(state_id)]
+
+    def result(self, status, plan=None):
+        self.statistics.stop(self)
+        if plan is not None and self.on_solution is not None:
+            self.on_solution(plan)
+        return SearchResult(status, plan, self.statistics)
 
     def explore_nodes(self):
-        while self.frontier:
-            node = self.frontier.popleft()
-            if node.state not in self.explored:
-                self.explored.add(node.state)
-                yield node
-
-    def expand_node(self, node):
-        for action in node.state.possible_actions():
-            successor = node.state.successor(action)
-            if successor not in self.explored:
-                self.frontier.append(SearchNode(successor, node, action))
-
-
-class SearchNode:
-    def __init__(self, state, parent=None, action=None):
-        self.state = state
-        self.parent = parent
-        self.action = action
-
-    def history(self):
-        if self.parent:
-            h = self.parent.history()
-            h.append(self.action)
-            return h
+        closed = self.registry.closed
+        frontier = self.frontier
+        statistics = self.statistics
+        on_expand = self.on_expand
+        while frontier:
+            if statistics.expanded % LIMIT_CHECK_INTERVAL == 0 or self.limits.nodes is not None:
+                self.stopped = self.check_limits()
+                if self.stopped:
+                    return
+            if len(frontier) > statistics.peak_frontier:
+                statistics.peak_frontier = len(frontier)
+            state_id = self.pop_node()
+            if not closed[state_id]:
+                closed[state_id] = 1
+                statistics.expanded += 1
+                if on_expand is not None:
+                    on_expand(state_id)
+                yield state_id
+
+    def check_limits(self):
+        if self.cancel is not None and self.cancel.cancelled:
+            return SearchResult.CANCELLED
+        return self.limits.exceeded(self.statistics)
+
+    def expand_node(self, state_id):
+        registry = self.registry
+        on_generate = self.on_generate
+        bits = registry.states[state_id]
+        path_cost = registry.costs[state_id] + 1
+        successors = duplicates = 0
+        for action in self.successor_generator.applicable(bits):
+            successors += 1
+            successor = action.apply(bits)
+            key = registry.successor_key(state_id, bits, successor, action)
+            successor_id = registry.lookup(successor, key)
+            if successor_id is None:
+                successor_id = self.register(successor, key, state_id, action.id, path_cost)
+                self.push_node(successor_id)
+                if on_generate is not None:
+                    on_generate(successor_id, state_id, action)
+            elif self.can_reopen(successor_id, path_cost):
+                registry.update(successor_id, state_id, action.id, path_cost)
+                registry.closed[successor_id] = 0
+                self.push_node(successor_id)
+                self.statistics.reopened += 1
+            else:
+                duplicates += 1
+        self.statistics.successors += successors
+        self.statistics.duplicates += duplicates
+
+    def register(self, bits, key, parent=-1, action=-1, path_cost=0):
+        return self.registry.insert(bits, key, parent, action, path_cost)
+
+    def push_node(self, state_id):
+        self.frontier.append(state_id)
+
+    def pop_node(self):
+        return self.frontier.popleft()
+
+    # Whether an already generated state should be queued again because we found a cheaper path
+    # to it. Breadth-first search always reaches states by a shortest path first.
+    def can_reopen(self, state_id, path_cost):
+        return False
+
+
+# Expands states in order of path_cost + weight * remaining_cost, where remaining_cost comes from
+# one of the heuristics in planner.heuristic (given either by name or as an already built
+# heuristic). Every action costs 1. States that can't lead to a plan shorter than bound are pruned.
+class BestFirstSearch(ForwardSearch):
+    DEFAULT_HEURISTIC = 'ff'
+
+    def __init__(self, problem, heuristic=None, weight=1, bound=INFINITY):
+        super().__init__(problem)
+        if heuristic is None or isinstance(heuristic, str):
+            heuristic = HEURISTICS[heuristic or self.DEFAULT_HEURISTIC](problem)
+        self.heuristic = heuristic
+        self.weight = weight
+        self.bound = bound
+
+        self.frontier = []
+        self.remaining_costs = array('d')
+
+    def register(self, bits, key, parent=-1, action=-1, path_cost=0):
+        self.remaining_costs.append(self.heuristic.evaluate(bits))
+        return super().register(bits, key, parent, action, path_cost)
+
+    def push_node(self, state_id):
+        remaining_cost = self.remaining_costs[state_id]
+        path_cost = self.registry.costs[state_id]
+        # No point keeping around states the relaxed problem already says are dead ends. Any state
+        # that isn't a goal (which is exactly when the estimate is non-zero) is at least one more
+        # action away from one.
+        if remaining_cost != INFINITY and path_cost + min(remaining_cost, 1) < self.bound:
+            priority = self.priority(path_cost, remaining_cost)
+            heapq.heappush(self.frontier, (priority, remaining_cost, state_id))
         else:
-            return []
+            self.statistics.pruned += 1
+
+    def pop_node(self):
+        return heapq.heappop(self.frontier)[-1]
+
+    def priority(self, path_cost, remaining_cost):
+        return path_cost + self.weight * remaining_cost
+
+    # With a bound, expanded states are reopened too. The heuristics aren't admissible, so a state
+    # can be expanded before its shortest path is found, and everything below it would then be
+    # pruned against the bound by path costs that are too high.
+    def can_reopen(self, state_id, path_cost):
+        if path_cost >= self.registry.costs[state_id]:
+            return False
+        return not self.registry.closed[state_id] or self.bound != INFINITY
+
+class AStarSearch(BestFirstSearch):
+    # h_max is admissible, so by default A* returns shortest plans like the blind search does
+    DEFAULT_HEURISTIC = 'max'
+
+class WeightedAStarSearch(BestFirstSearch):
+    def __init__(self, problem, heuristic=None, weight=2, bound=INFINITY):
+        super().__init__(problem, heuristic, weight, bound)
+
+class GreedySearch(BestFirstSearch):
+    def priority(self, path_cost, remaining_cost):
+        return remaining_cost
+
+
+# Finds a first plan quickly with greedy search, then keeps looking for shorter ones with weighted
+# A* using each of weights in turn, pruning anything that can't beat the best plan so far. Once the
+# weights run out, A* is repeated. The bounded searches reopen states they find a shorter path to,
+# so as soon as one of them, whatever its weight, can't find anything shorter, the last plan is
+# proven to be the shortest.
+#
+# deadline (in seconds) only bounds the improvement phase: the first plan is searched for until the
+# limits given to run stop it. The result has the best plan found when the search stopped. Running
+# out of improvements or into the deadline counts as solved; if the limits given to run or cancel
+# stop it, the result has their status instead. The hooks are the same as ForwardSearch's, and
+# on_solution is called for every better plan.
+class AnytimeSearch:
+    DEFAULT_HEURISTIC = 'ff'
+    WEIGHTS = (5, 3, 2, 1.5, 1)
+
+    def __init__(self, problem, heuristic=None, weights=WEIGHTS, deadline=None):
+        self.problem = problem
+        self.statistics = SearchStatistics()
+        self.statistics.time_phase('ground', problem.ground)
+        self.heuristic = CachedHeuristic(HEURISTICS[heuristic or self.DEFAULT_HEURISTIC](problem))
+        self.weights = weights
+        self.deadline = deadline
+        self.plans = []
+
+        self.on_expand = None
+        self.on_generate = None
+        self.on_solution = None
+
+    def search(self):
+        return self.run().plan
+
+    def run(self, limits=None, cancel=None):
+        self.limits = limits or SearchLimits()
+        self.statistics.start()
+
+        result = self.run_iteration(GreedySearch(self.problem, self.heuristic), self.limits, cancel)
+        if result.status != SearchResult.SOLVED:
+            return self.result(result.status)
+
+        weights = iter(self.weights)
+        while True:
+            bound = len(self.plans[-1])
+            search = WeightedAStarSearch(self.problem, self.heuristic, next(weights, 1), bound)
+            result = self.run_iteration(search, self.improvement_limits(), cancel)
+            if result.status == SearchResult.UNSOLVABLE or self.hit_deadline(result):
+                return self.result(SearchResult.SOLVED)
+            elif result.status != SearchResult.SOLVED:
+                return self.result(result.status)
+
+    def run_iteration(self, search, limits, cancel):
+        search.on_expand = self.on_expand
+        search.on_generate = self.on_generate
+        search.on_solution = self.on_solution
+        result = search.run(limits, cancel)
+        self.statistics.add(result.statistics)
+        if result.status == SearchResult.SOLVED:
+            self.plans.append(result.plan)
+        return result
+
+    # What's left of the overall limits, with the time cut down to the deadline
+    def improvement_limits(self):
+        elapsed = self.statistics.elapsed()
+        limits = SearchLimits(memory=self.limits.memory)
+        if self.limits.time is not None:
+            limits.time = self.limits.time - elapsed
+        if self.deadline is not None:
+            limits.time = min(self.deadline - elapsed, limits.time or INFINITY)
+        if self.limits.nodes is not None:
+            limits.nodes = self.limits.nodes - self.statistics.expanded
+        return limits
+
+    # Whether an improvement search was stopped by the deadline rather than by the overall limits
+    def hit_deadline(self, result):
+        if result.status != SearchResult.TIME_LIMIT or self.deadline is None:
+            return False
+        return self.limits.time is None or self.deadline < self.limits.time
+
+    def result(self, status):
+        self.statistics.stop()
+        return SearchResult(status, self.plans[-1] if self.plans else None, self.statistics)
+
+
+# Breadth-first search spread over several worker processes, in the style of hash distributed A*
+# (HDA*): every state is owned by the worker its hash maps to, which is the only one that stores,
+# deduplicates and expands it.
+#
+# The search runs one layer (path cost) at a time. Each worker expands its part of the current layer
+# and sends the successors it generates to their owners in batches, followed by an end of layer
+# marker to every worker. A worker's next layer is complete once it has seen a marker from everyone,
+# after which it reports back here. The search ends at the first layer containing a goal, so plans
+# are shortest ones, or once a layer comes up empty.
+#
+# States are referred to across workers by a global id, local_id * workers + owner. Limits and
+# cancellation are checked between layers. Workers are forked so that they inherit the grounded
+# problem, since its compiled conditions can't be pickled. Of the hooks, only on_solution is
+# supported.
+class ParallelSearch:
+    def __init__(self, problem, workers=None):
+        self.problem = problem
+        self.statistics = SearchStatistics()
+        self.actions = self.statistics.time_phase('ground', problem.ground)
+        self.start = SearchState.from_problem(problem)
+        self.workers = workers or os.cpu_count()
+        self.on_solution = None
+
+    def search(self):
+        return self.run().plan
+
+    def run(self, limits=None, cancel=None):
+        limits = limits or SearchLimits()
+        self.statistics.start()
+        if self.problem.goal_test(self.start.bits):
+            return self.result(SearchResult.SOLVED, [])
+
+        context = multiprocessing.get_context('fork')
+        self.inboxes = [context.Queue() for _ in range(self.workers)]
+        connections = []
+        processes = []
+        for index in range(self.workers):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=self.work, args=(index, worker_connection), daemon=True)
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        try:
+            return self.search_layers(connections, limits, cancel)
+        finally:
+            for connection in connections:
+                try:
+                    connection.send(('stop', None))
+                except OSError:
+                    pass
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+
+    def search_layers(self, connections, limits, cancel):
+        while True:
+            if cancel is not None and cancel.cancelled:
+                return self.result(SearchResult.CANCELLED)
+
+            for connection in connections:
+                connection.send(('expand', None))
+            reports = [connection.recv() for connection in connections]
+
+            self.statistics.expanded += sum(report[0] for report in reports)
+            self.statistics.generated = sum(report[1] for report in reports)
+            self.statistics.successors += sum(report[5] for report in reports)
+            self.statistics.duplicates += sum(report[5] - report[2] for report in reports)
+            self.statistics.peak_frontier = max(self.statistics.peak_frontier,
+                                                sum(report[2] for report in reports))
+            goals = [report[3] for report in reports if report[3] is not None]
+            if goals:
+                plan = self.statistics.time_phase('extract', self.trace, connections, min(goals))
+                return self.result(SearchResult.SOLVED, plan)
+            elif not any(report[2] for report in reports):
+                return self.result(SearchResult.UNSOLVABLE)
+
+            stopped = limits.exceeded(self.statistics, max(report[4] for report in reports))
+            if stopped:
+                return self.result(stopped)
+
+    # Follows parent pointers back from the goal, asking each state's owner for them
+    def trace(self, connections, global_id):
+        plan = []
+        while True:
+            connections[global_id % self.workers].send(('trace', global_id // self.workers))
+            parent, action_id = connections[global_id % self.workers].recv()
+            if parent == -1:
+                plan.reverse()
+                return plan
+            plan.append(self.actions[action_id])
+            global_id = parent
+
+    def owner(self, bits):
+        return partition(bits, self.workers)
+
+    # Runs in each worker process
+    def work(self, index, connection):
+        registry = StateRegistry.for_problem(self.problem)
+        frontier = []
+        if self.owner(self.start.bits) == index:
+            frontier.append(registry.insert(self.start.bits, registry.key(self.start.bits)))
+
+        expanded = 0
+        while True:
+            command, argument = connection.recv()
+            if command == 'expand':
+                expanded, successors, frontier, goal = self.expand_layer(index, registry, frontier)
+                connection.send((expanded, len(registry), len(frontier), goal, memory_usage(),
+                                 successors))
+            elif command == 'trace':
+                connection.send((registry.parents[argument], registry.actions[argument]))
+            elif command == 'stop':
+                return
+
+    def expand_layer(self, index, registry, frontier):
+        workers = self.workers
+        inboxes = self.inboxes
+        goal_test = self.problem.goal_test
+        next_frontier = []
+        goal = None
+
+        def add(successor, parent, action_id, path_cost):
+            nonlocal goal
+            key = registry.key(successor)
+            if registry.lookup(successor, key) is None:
+                state_id = registry.insert(successor, key, parent, action_id, path_cost)
+                next_frontier.append(state_id)
+                if goal is None and goal_test(successor):
+                    goal = state_id * workers + index
+
+        successors = 0
+        batches = [[] for _ in range(workers)]
+        for state_id in frontier:
+            bits = registry.states[state_id]
+            parent = state_id * workers + index
+            path_cost = registry.costs[state_id] + 1
+            for action in self.problem.successor_generator.applicable(bits):
+                successors += 1
+                successor = action.apply(bits)
+                owner = partition(successor, workers)
+                if owner == index:
+                    add(successor, parent, action.id, path_cost)
+                    continue
+                batch = batches[owner]
+                batch.append((successor, parent, action.id, path_cost))
+                if len(batch) >= PARALLEL_BATCH_SIZE:
+                    inboxes[owner].put(batch)
+                    batches[owner] = []
+        for owner in range(workers):
+            if owner != index:
+                if batches[owner]:
+                    inboxes[owner].put(batches[owner])
+                inboxes[owner].put(None)
+
+        finished = 1
+        while finished < workers:
+            batch = inboxes[index].get()
+            if batch is None:
+                finished += 1
+                continue
+            for successor, parent, action_id, path_cost in batch:
+                add(successor, parent, action_id, path_cost)
+        return len(frontier), successors, next_frontier, goal
+
+    def result(self, status, plan=None):
+        self.statistics.stop()
+        if plan is not None and self.on_solution is not None:
+            self.on_solution(plan)
+        return SearchResult(status, plan, self.statistics)
 
-    def __lt__(self, other):
-        return (self.path_cost + self.remaining_cost) < (other.path_cost + other.remaining_cost)
+PARALLEL_BATCH_SIZE = 256
+PARTITION_MULTIPLIER = 0x9E3779B97F4A7C15 # 2**64 divided by the golden ratio
+
+# Picks the worker that owns a state. hash(bits) is just bits for states below 2**61, so taking
+# it modulo workers would only look at the lowest few atoms, which hardly ever change. Multiplying
+# by an odd constant and keeping the top bits of the low 64 (Fibonacci hashing) mixes every bit
+# of the hash into the result.
+def partition(bits, workers):
+    return (((hash(bits) * PARTITION_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> 32) % workers
+
+
+LIMIT_CHECK_INTERVAL = 64
+
+# Budgets for a search. time is in seconds, nodes counts expanded states and memory is the current
+# resident size of the process (of each worker, for a parallel search) in megabytes. Any of them can be None for no limit.
+class SearchLimits:
+    def __init__(self, time=None, nodes=None, memory=None):
+        self.time = time
+        self.nodes = nodes
+        self.memory = memory
+
+    # Returns the status for the first limit the statistics are over, if any. memory is the memory
+    # use in bytes, if it should be something other than this process's.
+    def exceeded(self, statistics, memory=None):
+        if self.nodes is not None and statistics.expanded >= self.nodes:
+            return SearchResult.NODE_LIMIT
+        if self.time is not None and statistics.elapsed() >= self.time:
+            return SearchResult.TIME_LIMIT
+        if self.memory is not None and (memory or memory_usage()) >= self.memory * 1024 * 1024:
+            return SearchResult.MEMORY_LIMIT
+        return None
+
+# Returns the resident size of this process in bytes. Linux reports the current size, which goes
+# down again when memory is freed; elsewhere this falls back to the peak size over the process's
+# whole life, so the memory limit is only reliable in a fresh process.
+def memory_usage():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and kilobytes everywhere else
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Lets another thread ask a running search to stop.
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+# Counters for a search. generated counts distinct states, while successors counts every successor
+# of an expanded state, including the duplicates of states that had already been seen (and weren't
+# reopened). pruned counts states that never made it into the frontier, e.g. dead ends. States are
+# closed exactly when they're expanded, so the closed list peaks at expanded.
+#
+# phase_times has the seconds spent grounding, searching and extracting the plan. Grounding happens
+# when the search is created, before its clock starts, so elapsed() (the time in serialize) is the
+# time the search itself took: searching plus extracting the plan.
+class SearchStatistics:
+    def __init__(self):
+        self.expanded = 0
+        self.generated = 0
+        self.successors = 0
+        self.duplicates = 0
+        self.reopened = 0
+        self.pruned = 0
+        self.peak_frontier = 0
+        self.phase_times = { 'ground': 0, 'search': 0, 'extract': 0 }
+        self.start_time = None
+        self.end_time = None
+
+    def time_phase(self, phase, f, *args):
+        start = time.monotonic()
+        try:
+            return f(*args)
+        finally:
+            self.phase_times[phase] += time.monotonic() - start
+
+    @property
+    def branching_factor(self):
+        return self.successors / self.expanded if self.expanded else 0
+
+    # Adds the counts from the statistics of another search, e.g. one of several run one after
+    # the other
+    def add(self, other):
+        for counter in ('expanded', 'generated', 'successors', 'duplicates', 'reopened', 'pruned'):
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        self.peak_frontier = max(self.peak_frontier, other.peak_frontier)
+        for phase, phase_time in other.phase_times.items():
+            self.phase_times[phase] += phase_time
+
+    def start(self):
+        self.start_time = time.monotonic()
+
+    def stop(self, search=None):
+        if search is not None:
+            self.generated = len(search.registry)
+        self.end_time = time.monotonic()
+        self.phase_times['search'] = self.elapsed() - self.phase_times['extract']
+
+    def elapsed(self):
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    def serialize(self):
+        return {
+            'expanded': self.expanded,
+            'generated': self.generated,
+            'successors': self.successors,
+            'duplicates': self.duplicates,
+            'reopened': self.reopened,
+            'pruned': self.pruned,
+            'peak_frontier': self.peak_frontier,
+            'branching_factor': self.branching_factor,
+            'phase_times': dict(self.phase_times),
+            'time': self.elapsed(),
+        }
+
+    def __repr__(self):
+        return ('SearchStatistics(expanded=%d, generated=%d, duplicates=%d, pruned=%d, '
+                'peak_frontier=%d, branching_factor=%.2f, time=%.3f)' % (
+                    self.expanded, self.generated, self.duplicates, self.pruned,
+                    self.peak_frontier, self.branching_factor, self.elapsed()))
+
+class SearchResult:
+    SOLVED = 'solved'
+    UNSOLVABLE = 'unsolvable'
+    TIME_LIMIT = 'time-limit'
+    NODE_LIMIT = 'node-limit'
+    MEMORY_LIMIT = 'memory-limit'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, status, plan=None, statistics=None):
+        self.status = status
+        self.plan = plan
+        self.statistics = statistics
+
+    @property
+    def limit_reached(self):
+        return self.status in (SearchResult.TIME_LIMIT, SearchResult.NODE_LIMIT,
+                               SearchResult.MEMORY_LIMIT)
 
     def __repr__(self):
-        return 'SearchNode[%s]' % self.state
+        return 'SearchResult(status=%s, plan=%s, statistics=%s)' % (self.status, self.plan,
+                                                                    self.statistics)
+
+
+# Stores every packed state a search reaches once, under a dense integer id.
+#
+# The parent id, the id of the ground action that reached the state, its path cost and whether it
+# has been expanded are kept in parallel arrays indexed by state id. States are looked up by a key,
+# which for this class is just the packed state.
+class StateRegistry:
+    def __init__(self):
+        self.states = []
+        self.ids = {}
+        self.parents = array('q')
+        self.actions = array('q')
+        self.costs = array('q')
+        self.closed = bytearray()
+
+    # Hashing a packed state is a single C loop over its digits, which beats computing a Zobrist
+    # hash in Python until states get to a couple thousand atoms
+    @staticmethod
+    def for_problem(problem):
+        if len(problem.atoms) >= ZOBRIST_MIN_ATOMS:
+            return ZobristStateRegistry(problem.atoms)
+        return StateRegistry()
+
+    def key(self, bits):
+        return bits
+
+    def successor_key(self, state_id, bits, successor, action):
+        return successor
+
+    def lookup(self, bits, key):
+        return self.ids.get(key)
 
+    def insert(self, bits, key, parent=-1, action=-1, path_cost=0):
+        state_id = len(self.states)
+        self.states.append(bits)
+        self.ids[key] = state_id
+        self.parents.append(parent)
+        self.actions.append(action)
+        self.costs.append(path_cost)
+        self.closed.append(0)
+        return state_id
+
+    def update(self, state_id, parent, action, path_cost):
+        self.parents[state_id] = parent
+        self.actions[state_id] = action
+        self.costs[state_id] = path_cost
+
+    # Returns the ids of the actions leading from the initial state to this one
+    def path(self, state_id):
+        actions = []
+        while self.parents[state_id] != -1:
+            actions.append(self.actions[state_id])
+            state_id = self.parents[state_id]
+        actions.reverse()
+        return actions
+
+    def __len__(self):
+        return len(self.states)
+
+ZOBRIST_MIN_ATOMS = 2048
+
+# Keys states by their Zobrist hash (see AtomTable), which is updated incrementally from the
+# parent's hash and the atoms the action changed. States are only compared in full when their hashes
+# match.
+class ZobristStateRegistry(StateRegistry):
+    def __init__(self, atoms):
+        super().__init__()
+        self.atoms = atoms
+        self.hashes = array('Q')
+
+    def key(self, bits):
+        return self.atoms.hash(bits)
+
+    def successor_key(self, state_id, bits, successor, action):
+        return self.hashes[state_id] ^ action.hash_change(bits, successor, self.atoms)
+
+    def lookup(self, bits, key):
+        entry = self.ids.get(key)
+        if entry is None:
+            return None
+        elif type(entry) is int:
+            return entry if self.states[entry] == bits else None
+        for state_id in entry:
+            if self.states[state_id] == bits:
+                return state_id
+        return None
+
+    def insert(self, bits, key, parent=-1, action=-1, path_cost=0):
+        # Colliding states share a list of ids
+        entry = self.ids.get(key)
+        state_id = super().insert(bits, key, parent, action, path_cost)
+        if entry is not None:
+            self.ids[key] = [entry, state_id] if type(entry) is int else entry + [state_id]
+        self.hashes.append(key)
+        return state_id
+
+
+# Decision tree for finding the ground actions applicable in a state.
+#
+# Each action is filed under the path of its positive precondition atoms, most commonly required
+# atoms first (e.g. where the player is), so a lookup only descends into branches whose atom holds
+# in the state instead of testing every ground action.
+class SuccessorGenerator:
+    def __init__(self, actions):
+        frequency = defaultdict(int)
+        atom_ids = []
+        for action in actions:
+            ids = bit_indices(action.positive_mask)
+            atom_ids.append(ids)
+            for atom_id in ids:
+                frequency[atom_id] += 1
+
+        root = ([], {})
+        for action, ids in zip(actions, atom_ids):
+            node = root
+            for atom_id in sorted(ids, key=lambda i: (-frequency[i], i)):
+                node = node[1].setdefault(atom_id, ([], {}))
+            node[0].append(action)
+        self.root = self.freeze(root)
+
+    # Turns the children dicts into lists of (mask, child) pairs, which are quicker to scan
+    def freeze(self, node):
+        actions, children = node
+        return (actions, [(1 << atom_id, self.freeze(child))
+                          for atom_id, child in sorted(children.items())])
+
+    def applicable(self, bits):
+        stack = [self.root]
+        while stack:
+            actions, children = stack.pop()
+            for action in actions:
+                if action.test(bits):
+                    yield action
+            for mask, child in children:
+                if bits & mask:
+                    stack.append(child)
+
+def bit_indices(bits):
+    indices = []
+    while bits:
+        low = bits & -bits
+        indices.append(low.bit_length() - 1)
+        bits ^= low
+    return indices
+
+
+SEARCHES = {
+    'bfs': ForwardSearch,
+    'astar': AStarSearch,
+    'wastar': WeightedAStarSearch,
+    'gbfs': GreedySearch,
+    'anytime': AnytimeSearch,
+    'parallel': ParallelSearch,
+}
+
+# Searches that don't take a heuristic
+BLIND_SEARCHES = (ForwardSearch, ParallelSearch)
+
+
+# States are packed into an int with one bit per atom in the problem's AtomTable. Static facts
+# aren't stored in states at all, they live in the problem's static_facts.
 class SearchState:
-    def __init__(self, problem, fluents):
+    _index = None
+
+    def __init__(self, problem, bits):
         self.problem = problem
         self.domain = problem.domain
-        self.fluents = frozenset(fluents)
+        self.bits = bits
+
+    @property
+    def fluents(self):
+        return frozenset(self.problem.atoms.unpack(self.bits))
+
+    def holds(self, atom):
+        return atom in self.problem.static_facts or self.problem.atoms.holds(atom, self.bits)
 
     def possible_actions(self):
-        for action in self.domain.actions.values():
-            for binding in self.possible_bindings([p.type for p in action.parameters]):
-                if action.precondition.test(self, dict(zip(action.parameters, binding))):
-                    yield action.instantiate(list(binding))
-
-    # Destructively mutates accumulated return value after yielding
-    def possible_bindings(self, binding_types, acc=None):
-        if acc is None:
-            acc = []
-        if not binding_types:
-            yield acc
-        else:
-            for obj in self.problem.objects_of_type[binding_types[0]]:
-                acc.append(obj)
-                for b in self.possible_bindings(binding_types[1:], acc):
-                    yield b
-                acc.pop()
+        self.problem.ground()
+        return self.problem.successor_generator.applicable(self.bits)
+
+    def possible_bindings(self, binding_types):
+        return self.problem.possible_bindings(binding_types)
+
+    def bindings(self, vars, generators, env={}):
+        return matching_bindings(vars, generators, env, self.index, self.problem)
+
+    # Index over the static facts and this state's fluents, only built if a quantifier needs it
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = FactIndex([*self.problem.static_facts,
+                                     *self.problem.atoms.unpack(self.bits)])
+        return self._index
 
     def successor(self, action):
-        fluents = set(self.fluents)
-        action.apply(fluents)
-        return SearchState(self.problem, fluents)
+        return SearchState(self.problem, action.apply(self.bits))
 
     def satisfies(self, expr):
         return expr.test(self)
 
     def __hash__(self):
-        return hash((self.problem, self.domain, self.fluents))
+        return hash(self.bits)
 
     def __eq__(self, other):
-        return (self.problem == other.problem and
-                self.domain == other.domain and
-                self.fluents == other.fluents)
+        return self.problem == other.problem and self.bits == other.bits
+
+    def __repr__(self):
+        return 'SearchState[%s]' % ' '.join(str(atom) for atom in self.problem.atoms.unpack(self.bits))
 
     @staticmethod
     def from_problem(problem):
-        return SearchState(problem, problem.init)
+        return SearchState(problem, problem.atoms.mask(problem.initial_fluents))
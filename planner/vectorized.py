@@ -0,0 +1,197 @@
+from collections import defaultdict
+
+import numpy as np
+
+from planner.logic import split_literals
+from planner.search import SearchLimits, SearchResult, SearchState, SearchStatistics, bit_indices
+
+# Upper bound on the size of the (states, actions) arrays built while finding applicable actions,
+# so a big layer is processed in several chunks
+CHUNK_ELEMENTS = 1 << 22
+
+# Breadth-first search that handles a whole layer of states at once with NumPy.
+#
+# A layer is an array with one row per state, where each state is its packed bits split into 64-bit
+# words. To find the actions applicable in every state of a layer at once, the layer is unpacked
+# into a 0/1 matrix of states by atoms and multiplied by 0/1 matrices of atoms by actions for the
+# positive and negative preconditions: an action is applicable when the first product counts all its
+# positive atoms and the second counts none of its negative ones. Like the first level of
+# SuccessorGenerator, actions are grouped by their most commonly required atom (e.g. where the
+# player is) and each group is only checked against the states that have it. Successors are then all
+# built in one go from arrays of the effect masks.
+#
+# Duplicates are removed by sorting: rows are viewed as raw bytes so np.unique and np.searchsorted
+# can compare whole states against the (sorted) set of visited states.
+#
+# Precondition parts that aren't plain literals (e.g. disjunctions) can't be expressed as masks, so
+# actions with any are also run through their compiled test, as is a goal with any. Limits and
+# cancellation are checked between chunks. Of the hooks, only on_solution is supported.
+class VectorizedSearch:
+    def __init__(self, problem):
+        self.problem = problem
+        self.statistics = SearchStatistics()
+        self.actions = self.statistics.time_phase('ground', problem.ground)
+        self.start = SearchState.from_problem(problem)
+        self.on_solution = None
+
+        self.words = max(1, (len(problem.atoms) + 63) // 64)
+        self.key_type = np.dtype((np.void, self.words * 8))
+        self.atom_count = len(problem.atoms)
+        self.groups = self.group_actions()
+        self.add = self.pack([a.add_mask for a in self.actions])
+        self.keep = ~self.pack([a.del_mask for a in self.actions])
+        self.has_conditions = np.array([bool(a.conditions) for a in self.actions], dtype=bool)
+
+        goal_positive, goal_negative, goal_rest = split_literals(
+            problem.ground_goal.conjuncts(), problem.atoms)
+        self.goal_positive = self.pack([goal_positive])[0]
+        self.goal_negative = self.pack([goal_negative])[0]
+        self.goal_has_conditions = bool(goal_rest)
+
+    # Returns a list of (atom id or None, action ids, positive matrix, negative matrix, positive
+    # counts) for each group of actions, where the group's actions all require the atom
+    def group_actions(self):
+        frequency = defaultdict(int)
+        atom_ids = [bit_indices(action.positive_mask) for action in self.actions]
+        for ids in atom_ids:
+            for atom_id in ids:
+                frequency[atom_id] += 1
+
+        members = defaultdict(list)
+        for action_id, ids in enumerate(atom_ids):
+            members[max(ids, key=lambda i: (frequency[i], -i)) if ids else None].append(action_id)
+
+        groups = []
+        for atom_id, action_ids in members.items():
+            positive = self.matrix([self.actions[i].positive_mask for i in action_ids])
+            negative = self.matrix([self.actions[i].negative_mask for i in action_ids])
+            groups.append((atom_id, np.array(action_ids), positive, negative, positive.sum(axis=0)))
+        return groups
+
+    # Turns packed states into an array of rows of little-endian 64-bit words
+    def pack(self, bits_list):
+        size = self.words * 8
+        data = b''.join(bits.to_bytes(size, 'little') for bits in bits_list)
+        return np.frombuffer(data, dtype='<u8').reshape(len(bits_list), self.words).copy()
+
+    # Returns a float32 (atoms, len(bits_list)) matrix with a 1 wherever an atom is in the mask.
+    # Counts in float32 are exact up to 2^24, far more atoms than any precondition has.
+    def matrix(self, bits_list):
+        return self.bits(self.pack(bits_list)).T.copy()
+
+    # Unpacks a layer into a float32 (states, atoms) matrix of 0s and 1s
+    def bits(self, layer):
+        unpacked = np.unpackbits(np.ascontiguousarray(layer).view(np.uint8), axis=1,
+                                 bitorder='little')
+        return unpacked[:, :self.atom_count].astype(np.float32)
+
+    def unpack(self, row):
+        return int.from_bytes(row.tobytes(), 'little')
+
+    def keys(self, layer):
+        return np.ascontiguousarray(layer).view(self.key_type).ravel()
+
+    def search(self):
+        return self.run().plan
+
+    def run(self, limits=None, cancel=None):
+        self.limits = limits or SearchLimits()
+        self.cancel = cancel
+        self.statistics.start()
+
+        layer = self.pack([self.start.bits])
+        visited = np.sort(self.keys(layer))
+        # For each layer after the first, the index of each state's parent in the previous layer
+        # and the id of the action that reached it
+        history = []
+        while len(layer):
+            goal = self.find_goal(layer)
+            if goal is not None:
+                plan = self.statistics.time_phase('extract', self.trace, history, goal)
+                return self.result(SearchResult.SOLVED, plan, visited)
+            self.statistics.peak_frontier = max(self.statistics.peak_frontier, len(layer))
+
+            successors, parents, action_ids = [], [], []
+            for start in range(0, len(layer), self.chunk_size()):
+                stopped = self.check_limits()
+                if stopped:
+                    return self.result(stopped, None, visited)
+                chunk = layer[start:start + self.chunk_size()]
+                chunk_successors, chunk_parents, chunk_actions = self.expand(chunk)
+                successors.append(chunk_successors)
+                parents.append(chunk_parents + start)
+                action_ids.append(chunk_actions)
+                self.statistics.expanded += len(chunk)
+
+            successors = np.concatenate(successors)
+            keys, first = np.unique(self.keys(successors), return_index=True)
+            positions = np.searchsorted(visited, keys)
+            seen = np.zeros(len(keys), dtype=bool)
+            in_range = positions < len(visited)
+            seen[in_range] = visited[positions[in_range]] == keys[in_range]
+            new = first[~seen]
+            # keys is sorted and none of the new ones are in visited, so this is a merge
+            visited = np.insert(visited, positions[~seen], keys[~seen])
+            self.statistics.successors += len(successors)
+            self.statistics.duplicates += len(successors) - len(new)
+
+            layer = successors[new]
+            history.append((np.concatenate(parents)[new], np.concatenate(action_ids)[new]))
+        return self.result(SearchResult.UNSOLVABLE, None, visited)
+
+    def chunk_size(self):
+        return max(1, CHUNK_ELEMENTS // (len(self.actions) or 1))
+
+    # Returns every (successor, parent index, action id) for a chunk of a layer, as three arrays
+    def expand(self, chunk):
+        bits = self.bits(chunk)
+        all_parents, all_action_ids = [np.zeros(0, dtype=np.intp)], [np.zeros(0, dtype=np.intp)]
+        for atom_id, group, positive, negative, counts in self.groups:
+            rows = np.nonzero(bits[:, atom_id])[0] if atom_id is not None else np.arange(len(chunk))
+            if len(rows):
+                states = bits[rows]
+                applicable = (states @ positive == counts) & (states @ negative == 0)
+                parents, action_ids = np.nonzero(applicable)
+                all_parents.append(rows[parents])
+                all_action_ids.append(group[action_ids])
+        parents = np.concatenate(all_parents)
+        action_ids = np.concatenate(all_action_ids)
+
+        needs_test = np.nonzero(self.has_conditions[action_ids])[0]
+        if len(needs_test):
+            passed = np.ones(len(action_ids), dtype=bool)
+            for i in needs_test:
+                passed[i] = self.actions[action_ids[i]].test(self.unpack(chunk[parents[i]]))
+            parents, action_ids = parents[passed], action_ids[passed]
+
+        successors = (chunk[parents] & self.keep[action_ids]) | self.add[action_ids]
+        return successors, parents, action_ids
+
+    # Returns the index of a goal state in layer, if there is one
+    def find_goal(self, layer):
+        goals = np.nonzero(np.all((layer & self.goal_positive) == self.goal_positive, axis=1) &
+                           np.all((layer & self.goal_negative) == 0, axis=1))[0]
+        for i in goals:
+            if not self.goal_has_conditions or self.problem.goal_test(self.unpack(layer[i])):
+                return i
+        return None
+
+    def trace(self, history, index):
+        plan = []
+        for parents, action_ids in reversed(history):
+            plan.append(self.actions[action_ids[index]])
+            index = parents[index]
+        plan.reverse()
+        return plan
+
+    def check_limits(self):
+        if self.cancel is not None and self.cancel.cancelled:
+            return SearchResult.CANCELLED
+        return self.limits.exceeded(self.statistics)
+
+    def result(self, status, plan, visited):
+        self.statistics.generated = len(visited)
+        self.statistics.stop()
+        if plan is not None and self.on_solution is not None:
+            self.on_solution(plan)
+        return SearchResult(status, plan, self.statistics)
@@ -0,0 +1,125 @@
+from collections import defaultdict
+
+from portal.geometry import Segment
+
+# Walls in each leaf of a BVHBroadPhase
+BVH_LEAF_SIZE = 4
+# How much BVHBroadPhase pads its boxes by, so rounding can't make a segment miss a box it touches
+BOX_EPSILON = 1e-9
+
+# Finds the walls a segment might intersect with a grid of unit cells, each listing the walls that
+# pass through it (see Segment.intersecting_cells). Quick for small, busy levels, but the number of
+# cells it stores grows with the total length of the walls.
+class GridBroadPhase:
+    def __init__(self, walls):
+        self.cells = defaultdict(list)
+        for wall in walls:
+            for cell in wall.intersecting_cells():
+                self.cells[cell].append(wall)
+
+    # Yields each wall in the cells the segment from pos1 to pos2 passes through once, starting
+    # from pos1's end, so callers that stop at the first hit usually don't look far
+    def possible_intersections(self, pos1, pos2):
+        seen = set()
+        for cell in Segment(pos1, pos2).intersecting_cells():
+            for wall in self.cells.get(cell, ()):
+                if wall not in seen:
+                    seen.add(wall)
+                    yield wall
+
+
+class BVHNode:
+    def __init__(self, walls, children=None):
+        self.x_min = min(wall.x_min for wall in walls) - BOX_EPSILON
+        self.y_min = min(wall.y_min for wall in walls) - BOX_EPSILON
+        self.x_max = max(wall.x_max for wall in walls) + BOX_EPSILON
+        self.y_max = max(wall.y_max for wall in walls) + BOX_EPSILON
+        self.children = children
+        self.walls = walls if children is None else None
+
+    # Returns how far along the segment from (x1, y1) to (x1 + dx, y1 + dy), from 0 to 1, it
+    # enters this node's box, or None if it misses it
+    def entry(self, x1, y1, dx, dy):
+        t_min = 0.0
+        t_max = 1.0
+        if dx == 0:
+            if x1 < self.x_min or x1 > self.x_max:
+                return None
+        else:
+            t_low = (self.x_min - x1) / dx
+            t_high = (self.x_max - x1) / dx
+            if t_low > t_high:
+                t_low, t_high = t_high, t_low
+            t_min = max(t_min, t_low)
+            t_max = min(t_max, t_high)
+            if t_min > t_max:
+                return None
+        if dy == 0:
+            if y1 < self.y_min or y1 > self.y_max:
+                return None
+        else:
+            t_low = (self.y_min - y1) / dy
+            t_high = (self.y_max - y1) / dy
+            if t_low > t_high:
+                t_low, t_high = t_high, t_low
+            t_min = max(t_min, t_low)
+            t_max = min(t_max, t_high)
+            if t_min > t_max:
+                return None
+        return t_min
+
+
+# Finds the walls a segment might intersect with a bounding volume hierarchy: a binary tree of
+# boxes, built by splitting the walls in half along the wider spread of their centers until there
+# are at most BVH_LEAF_SIZE of them. It takes space proportional to the number of walls, however
+# long they are and however spread out, so it suits big, sparse levels better than the grid.
+class BVHBroadPhase:
+    def __init__(self, walls):
+        walls = list(walls)
+        self.root = self.build(walls) if walls else None
+
+    def build(self, walls):
+        if len(walls) <= BVH_LEAF_SIZE:
+            return BVHNode(walls)
+        centers = [wall.center() for wall in walls]
+        x_spread = max(c.x for c in centers) - min(c.x for c in centers)
+        y_spread = max(c.y for c in centers) - min(c.y for c in centers)
+        if x_spread >= y_spread:
+            order = sorted(range(len(walls)), key=lambda i: centers[i].x)
+        else:
+            order = sorted(range(len(walls)), key=lambda i: centers[i].y)
+        walls = [walls[i] for i in order]
+        middle = len(walls) // 2
+        return BVHNode(walls, (self.build(walls[:middle]), self.build(walls[middle:])))
+
+    # Yields the walls in the leaves whose boxes the segment from pos1 to pos2 passes through,
+    # visiting the nearer child of each node first
+    def possible_intersections(self, pos1, pos2):
+        if self.root is None:
+            return
+        x1 = pos1.x
+        y1 = pos1.y
+        dx = pos2.x - x1
+        dy = pos2.y - y1
+        if self.root.entry(x1, y1, dx, dy) is None:
+            return
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.walls is not None:
+                yield from node.walls
+                continue
+            hits = []
+            for child in node.children:
+                entry = child.entry(x1, y1, dx, dy)
+                if entry is not None:
+                    hits.append((entry, child))
+            if len(hits) == 2 and hits[0][0] < hits[1][0]:
+                hits.reverse()
+            stack.extend(child for _, child in hits)
+
+
+BROAD_PHASES = {
+    'grid': GridBroadPhase,
+    'bvh': BVHBroadPhase,
+}
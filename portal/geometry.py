@@ -1,5 +1,10 @@
 import math
 
+import numpy as np
+
+# How close a segment has to come to a cell for Segment.intersecting_cells to count it as touched
+CELL_EPSILON = 1e-9
+
 class Position:
     def __init__(self, x, y):
         self.x = x
@@ -82,11 +87,35 @@ class Segment:
                     return -1
         return 0
 
-    # Yields (x, y) integer pairs of cells this segment may have came into contact with
-    # TODO Raytrace to make this smarter
+    # Yields the (x, y) integer pairs of the cells (the unit squares from (x, y) to (x + 1, y + 1))
+    # this segment touches, starting from p1's end. This is a grid traversal like Amanatides and
+    # Woo's, done a row at a time: within each row the segment covers an x range that follows
+    # from where it enters and leaves the row, so it takes time proportional to the segment's
+    # length rather than to the area of its bounding box. Cells count as touched from within
+    # CELL_EPSILON, so both cells on either side of a border (and all four at a corner) are
+    # yielded for a segment that runs along or ends on it, and rounding can't make two segments
+    # that intersect miss sharing a cell.
     def intersecting_cells(self):
-        for x in range(math.floor(self.x_min), math.ceil(self.x_max) + 1):
-            for y in range(math.floor(self.y_min), math.ceil(self.y_max) + 1):
+        dx = self.x2 - self.x1
+        dy = self.y2 - self.y1
+        step_x = 1 if dx >= 0 else -1
+        step_y = 1 if dy >= 0 else -1
+        first_row = math.floor(self.y1 - step_y * CELL_EPSILON)
+        last_row = math.floor(self.y2 + step_y * CELL_EPSILON)
+        for y in range(first_row, last_row + step_y, step_y):
+            if dy == 0:
+                x_start, x_end = self.x1, self.x2
+            else:
+                # The part of the segment within the row (and CELL_EPSILON of it)
+                y_start = y - CELL_EPSILON if step_y > 0 else y + 1 + CELL_EPSILON
+                y_end = y + 1 + CELL_EPSILON if step_y > 0 else y - CELL_EPSILON
+                y_start = min(max(y_start, self.y_min), self.y_max)
+                y_end = min(max(y_end, self.y_min), self.y_max)
+                x_start = self.x1 + (y_start - self.y1) * dx / dy
+                x_end = self.x1 + (y_end - self.y1) * dx / dy
+            first_column = math.floor(x_start - step_x * CELL_EPSILON)
+            last_column = math.floor(x_end + step_x * CELL_EPSILON)
+            for x in range(first_column, last_column + step_x, step_x):
                 yield (x, y)
 
     @staticmethod
@@ -103,3 +132,55 @@ class Segment:
     def translate_properties(props, entities):
         pass
 
+
+
+# Segment.intersects for many segments and rays at once: the segments from (x1, y1) to (x2, y2)
+# against the rays from (px1, py1) to (px2, py2), where any of the arguments can be NumPy arrays
+# that broadcast together. Does the same floating point operations in the same order, so the
+# answers are exactly the same.
+def intersects_many(x1, y1, x2, y2, px1, py1, px2, py2):
+    x_min = np.minimum(x1, x2)
+    x_max = np.maximum(x1, x2)
+    y_min = np.minimum(y1, y2)
+    y_max = np.maximum(y1, y2)
+    outside = (((px1 < x_min) & (px2 < x_min)) | ((px1 > x_max) & (px2 > x_max)) |
+               ((py1 < y_min) & (py2 < y_min)) | ((py1 > y_max) & (py2 > y_max)))
+
+    det = ((x1 - x2) * (py1 - py2)) - ((y1 - y2) * (px1 - px2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (((x1 - px1) * (py1 - py2)) - ((y1 - py1) * (px1 - px2))) / det
+        u = (((x1 - x2) * (y1 - py1)) - ((y1 - y2) * (x1 - px1))) / -det
+    hit = ~outside & (det != 0) & (0.0 <= t) & (t <= 1.0) & (0.0 <= u) & (u <= 1.0)
+    return np.where(hit, np.sign(det), 0).astype(int)
+
+
+
+# The end points of a list of segments in NumPy arrays, for testing many rays against many segments
+# at once with intersects_many.
+class SegmentArrays:
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self.x1, self.y1, self.x2, self.y2 = (
+            np.array([getattr(segment, coordinate) for segment in self.segments], dtype=float)
+            for coordinate in ('x1', 'y1', 'x2', 'y2'))
+
+    def __len__(self):
+        return len(self.segments)
+
+    # Tests every ray against every segment. Returns an array with the shape of the ray arrays
+    # plus a last axis for the segments.
+    def intersections(self, px1, py1, px2, py2):
+        return self.paired_intersections(*(np.asarray(p, dtype=float)[..., None]
+                                           for p in (px1, py1, px2, py2)))
+
+    # Tests the segments (or the ones at the indices in ids) against rays that broadcast with them
+    def paired_intersections(self, px1, py1, px2, py2, ids=None):
+        if ids is None:
+            return intersects_many(self.x1, self.y1, self.x2, self.y2, px1, py1, px2, py2)
+        return intersects_many(self.x1[ids], self.y1[ids], self.x2[ids], self.y2[ids],
+                               px1, py1, px2, py2)
+
+    # Returns the segments the ray from pos1 to pos2 intersects, in order
+    def intersecting(self, pos1, pos2):
+        hit = self.intersections(pos1.x, pos1.y, pos2.x, pos2.y) != 0
+        return [self.segments[i] for i in np.nonzero(hit)[0]]
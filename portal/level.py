@@ -1,17 +1,17 @@
 import json
 import os
-from collections import defaultdict
 
 from portal import colors
+from portal.broadphase import BROAD_PHASES
 from portal.entity import Entity, Player, Portal, Button
 from portal.navigation import NavigationGraph
 from portal.wall import Segment, WallSegment, Door
 from portal.planning.problem import Problem
-from portal.geometry import Position, Segment
+from portal.geometry import Position, Segment, SegmentArrays
 
 class Level:
     def __init__(self, name=None, walls=None, entities=None, start=None, goal=None,
-                 capabilities=None):
+                 capabilities=None, broad_phase='grid'):
         self.name = name or 'New Level'
         self.walls = walls or []
         self.entities = entities or [Portal(None, None, 'portal1'), Portal(None, None, 'portal2')]
@@ -21,6 +21,8 @@ class Level:
         self.capabilities = capabilities or []
         self.player = Player(self.start.x, self.start.y)
         self._navigation = None
+        # Which of BROAD_PHASES finds the walls near a segment
+        self.broad_phase_type = broad_phase
         self._cache_walls()
 
     @property
@@ -44,16 +46,13 @@ class Level:
             y_max = max(y_max, wall.y1, wall.y2)
         self.bounds = (x_min, y_min, x_max, y_max)
 
-        self.wall_cache = defaultdict(set)
-        for wall in self.walls:
-            for cell in wall.intersecting_cells():
-                self.wall_cache[cell].add(wall)
+        self.broad_phase = BROAD_PHASES[self.broad_phase_type](self.walls)
+        self.wall_arrays = SegmentArrays(self.walls)
 
+    # Yields each wall that might intersect the segment from pos1 to pos2 once, roughly nearest
+    # first
     def possible_intersections(self, pos1, pos2):
-        intersections = set()
-        for cell in Segment(pos1, pos2).intersecting_cells():
-            intersections.update(self.wall_cache[cell])
-        return intersections
+        return self.broad_phase.possible_intersections(pos1, pos2)
 
     def segment_intersects(self, pos1, pos2, radius=0):
         s = Segment(pos1, pos2)
@@ -62,6 +61,8 @@ class Level:
             rays.append(s.offset(radius))
             rays.append(s.offset(-radius))
 
+        # One ray against the few walls along it, stopping at the first hit, is quicker one wall
+        # at a time than as a NumPy batch
         for ray in rays:
             for segment in self.possible_intersections(ray.p1, ray.p2):
                 if segment.intersects(ray.p1, ray.p2):
@@ -111,12 +112,12 @@ class Level:
         json.dump(self.serialize(), f)
 
     @staticmethod
-    def load(f):
+    def load(f, broad_phase='grid'):
         obj = json.load(f)
-        return Level.deserialize(obj)
+        return Level.deserialize(obj, broad_phase)
 
     @staticmethod
-    def deserialize(obj):
+    def deserialize(obj, broad_phase='grid'):
         name = obj['name']
         entities = (sorted([Entity.deserialize(entity) for entity in obj['entities']],
                            key=lambda e: e.ORDER)
@@ -126,7 +127,7 @@ class Level:
         start = Position(*obj['start'])
         goal = Position(*obj['goal'])
         capabilities = obj['capabilities']
-        return Level(name, walls, entities, start, goal, capabilities)
+        return Level(name, walls, entities, start, goal, capabilities, broad_phase)
 
 
 class Goal(Position):
@@ -1,10 +1,12 @@
 import math
 
+import numpy as np
+
 from portal import colors
 from portal.planning import objects
 from portal.search import AStarSearch
 from portal.wall import *
-from portal.geometry import Position
+from portal.geometry import Position, SegmentArrays
 
 PATH_NONE = 0
 PATH_TO = 1
@@ -12,6 +14,12 @@ PATH_FROM = 2
 PATH_BOTH = 3
 PATH_DOOR = 4
 PATH_GRILL = 5
+
+DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)] # East, North, West, South
+
+# Upper bound on the number of pairs (node and segment, or ray and wall) add_visibility tests in
+# one batch
+VISIBILITY_CHUNK_ELEMENTS = 1 << 20
 class NavigationGraph:
 
     def __init__(self, level):
@@ -26,6 +34,7 @@ class NavigationGraph:
         y_min = math.floor(y_min) - 1
         x_max = math.ceil(x_max)
         y_max = math.ceil(y_max)
+        self.edge_walls = self.find_edge_walls((x_min, y_min, x_max, y_max))
 
         # self.fill_nodes((x_min, y_min), Room(), (x_min, y_min, x_max, y_max))
         # outside = self.nodes
@@ -38,6 +47,7 @@ class NavigationGraph:
                     room = Room()
                     self.fill_nodes((x, y), room, (x_min, y_min, x_max, y_max))
                     self.rooms.append(room)
+        self.node_order = { node: i for i, node in enumerate(self.nodes.values()) }
         for room in self.rooms:
             room.determine_walls()
         self.add_visibility()
@@ -51,7 +61,7 @@ class NavigationGraph:
                 x, y = pos
                 node = NavigationNode(x + 0.5, y + 0.5, room)
                 self.nodes[pos] = node
-                for i, (dx, dy) in enumerate([(1, 0), (0, 1), (-1, 0), (0, -1)]):
+                for i, (dx, dy) in enumerate(DIRECTIONS):
                     x_next = x + dx
                     y_next = y + dy
                     next_pos = (x_next, y_next)
@@ -61,42 +71,78 @@ class NavigationGraph:
                     if not self.add_neighbor(node, i, pos, next_pos):
                         frontier.append(next_pos)
 
+    # Finds the walls crossed by the step from the center of each cell within bounds to the center
+    # of the next one in each direction, all at once. Returns a dict from (pos, direction) to the
+    # first such wall (in level order) and the side it's crossed on, for the steps that cross one.
+    def find_edge_walls(self, bounds):
+        x_min, y_min, x_max, y_max = bounds
+        walls = self.level.wall_arrays
+        wall_x_min = np.minimum(walls.x1, walls.x2)
+        wall_x_max = np.maximum(walls.x1, walls.x2)
+        wall_y_min = np.minimum(walls.y1, walls.y2)
+        wall_y_max = np.maximum(walls.y1, walls.y2)
+
+        edge_walls = {}
+        for direction, (dx, dy) in enumerate(DIRECTIONS):
+            # The cells whose step's bounding box overlaps each wall's: any others are rejected by
+            # the bounding box test anyway
+            x_lo = np.maximum(np.ceil(wall_x_min - 0.5 - max(dx, 0)), x_min).astype(int)
+            x_hi = np.minimum(np.floor(wall_x_max - 0.5 - min(dx, 0)), x_max).astype(int)
+            y_lo = np.maximum(np.ceil(wall_y_min - 0.5 - max(dy, 0)), y_min).astype(int)
+            y_hi = np.minimum(np.floor(wall_y_max - 0.5 - min(dy, 0)), y_max).astype(int)
+            widths = np.maximum(x_hi - x_lo + 1, 0)
+            counts = widths * np.maximum(y_hi - y_lo + 1, 0)
+
+            # One (wall, cell) pair for each cell in each wall's range, in wall order
+            wall_ids = np.repeat(np.arange(len(walls)), counts)
+            offsets = np.arange(len(wall_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+            xs = x_lo[wall_ids] + offsets % widths[wall_ids]
+            ys = y_lo[wall_ids] + offsets // widths[wall_ids]
+            sides = walls.paired_intersections(xs + 0.5, ys + 0.5, xs + 0.5 + dx, ys + 0.5 + dy,
+                                               wall_ids)
+
+            for i in np.nonzero(sides)[0]:
+                key = ((int(xs[i]), int(ys[i])), direction)
+                if key not in edge_walls:
+                    edge_walls[key] = (walls.segments[wall_ids[i]], int(sides[i]))
+        return edge_walls
+
     # Returns true if we've done everything we can right now, false if the next pos needs to be
     # added to the frontier
     def add_neighbor(self, node, direction, pos, next_pos):
         next_node = self.nodes.get(next_pos)
-        x1, y1 = pos
-        x2, y2 = next_pos
-        p1 = Position(x1 + 0.5, y1 + 0.5)
-        p2 = Position(x2 + 0.5, y2 + 0.5)
-        for wall in self.level.possible_intersections(p1, p2):
-            intersection = wall.intersects(p1, p2)
-            # If we've already explored this node, add the appropriate connections.
-            # If not, then if there's no wall between the two nodes, add it to our frontier.
-            # If there is a wall, leave it to be discovered (and potentially connected)
-            # later.
-            if intersection:
-                # Need special handling so we can determine which segments to create portals on
-                if isinstance(wall, PortalWall):
-                    for segment in wall.segments:
-                        if segment.intersects(p1, p2):
-                            node.add_neighbor(direction, None, segment, intersection)
-                elif isinstance(wall, Wall):
-                    node.add_neighbor(direction, None, wall, intersection)
-                elif next_node:
-                    if isinstance(wall, Door) or isinstance(wall, Grill):
-                        path_from = True
-                        path_to = True
-                    elif isinstance(wall, Ledge) and intersection > 0:
-                        path_from = True
-                        path_to = False
-                    elif isinstance(wall, Ledge) and intersection < 0:
-                        path_from = False
-                        path_to = True
-
-                    node.add_neighbor(direction, (next_node if path_from else None), wall, intersection)
-                    next_node.add_neighbor((direction + 2) % 4, (node if path_to else None), wall, -intersection)
-                return True
+        edge_wall = self.edge_walls.get((pos, direction))
+        # If we've already explored this node, add the appropriate connections.
+        # If not, then if there's no wall between the two nodes, add it to our frontier.
+        # If there is a wall, leave it to be discovered (and potentially connected)
+        # later.
+        if edge_wall:
+            wall, intersection = edge_wall
+            # Need special handling so we can determine which segments to create portals on
+            if isinstance(wall, PortalWall):
+                x1, y1 = pos
+                x2, y2 = next_pos
+                p1 = Position(x1 + 0.5, y1 + 0.5)
+                p2 = Position(x2 + 0.5, y2 + 0.5)
+                for segment in wall.segments:
+                    if segment.intersects(p1, p2):
+                        node.add_neighbor(direction, None, segment, intersection)
+            elif isinstance(wall, Wall):
+                node.add_neighbor(direction, None, wall, intersection)
+            elif next_node:
+                if isinstance(wall, Door) or isinstance(wall, Grill):
+                    path_from = True
+                    path_to = True
+                elif isinstance(wall, Ledge) and intersection > 0:
+                    path_from = True
+                    path_to = False
+                elif isinstance(wall, Ledge) and intersection < 0:
+                    path_from = False
+                    path_to = True
+
+                node.add_neighbor(direction, (next_node if path_from else None), wall, intersection)
+                next_node.add_neighbor((direction + 2) % 4, (node if path_to else None), wall, -intersection)
+            return True
 
         # No wall intersection
         if next_node:
@@ -106,37 +152,75 @@ class NavigationGraph:
         else:
             return False
 
-    # This is a stupid number of nested loops, I'm sure we could do something more clever
+    # Works out which portal wall segments of each room every node can see: the ones that face the
+    # node and that aren't hidden behind any wall other than a ledge or the segment's own wall.
+    # Rather than testing one ray and wall at a time, every (node, segment) ray is tested against
+    # every wall in a few big NumPy batches.
     def add_visibility(self):
-        for node in self.nodes.values():
-            for room in self.rooms:
-                visible_segments = []
-                for segment, direction in room.wall_segments:
-                    # Check if we're coming at the wall from the right direction
-                    if segment.intersects(node, segment.center()) == direction:
-                        if self.is_segment_visible(segment, node):
-                            visible_segments.append(segment)
-                node.visible_rooms[room] = visible_segments
-
-    def is_segment_visible(self, segment, node):
-        for other_wall in self.level.possible_intersections(node, segment.center()):
-            if ((not isinstance(other_wall, Ledge)) and other_wall != segment.parent and
-                    other_wall.intersects(node, segment.center())):
-                return False
-        return True
+        nodes = list(self.nodes.values())
+        for node in nodes:
+            node.visible_rooms = { room: [] for room in self.rooms }
+        targets = [(room, segment, direction)
+                   for room in self.rooms for segment, direction in room.wall_segments]
+        if not targets:
+            return
+
+        segments = SegmentArrays(segment for _, segment, _ in targets)
+        centers = [segment.center() for segment in segments.segments]
+        center_x = np.array([center.x for center in centers], dtype=float)
+        center_y = np.array([center.y for center in centers], dtype=float)
+        directions = np.array([direction for _, _, direction in targets])
+        node_x = np.array([node.x for node in nodes], dtype=float)
+        node_y = np.array([node.y for node in nodes], dtype=float)
+
+        walls = SegmentArrays(wall for wall in self.level.walls if not isinstance(wall, Ledge))
+        # A segment's own wall can't hide it
+        can_block = np.array([[wall is not segment.parent for wall in walls.segments]
+                              for segment in segments.segments],
+                             dtype=bool).reshape(len(segments), -1)
+
+        # Only segments facing the node are worth checking for walls in the way. Both tests go
+        # through the nodes a few at a time, so neither holds more than about
+        # VISIBILITY_CHUNK_ELEMENTS entries at once.
+        node_chunk = max(1, VISIBILITY_CHUNK_ELEMENTS // len(targets))
+        pair_chunk = max(1, VISIBILITY_CHUNK_ELEMENTS // max(1, len(walls)))
+        for node_start in range(0, len(nodes), node_chunk):
+            x = node_x[node_start:node_start + node_chunk]
+            y = node_y[node_start:node_start + node_chunk]
+            facing = segments.paired_intersections(x[:, None], y[:, None],
+                                                   center_x, center_y) == directions
+            node_ids, target_ids = np.nonzero(facing)
+            node_ids += node_start
+            for start in range(0, len(node_ids), pair_chunk):
+                n = node_ids[start:start + pair_chunk]
+                t = target_ids[start:start + pair_chunk]
+                hits = walls.intersections(node_x[n], node_y[n], center_x[t], center_y[t]) != 0
+                visible = ~np.any(hits & can_block[t], axis=1)
+                # np.nonzero went through the nodes in order, and each node's segments in order
+                for node_id, target_id in zip(n[visible], t[visible]):
+                    room, segment, _ = targets[target_id]
+                    nodes[node_id].visible_rooms[room].append(segment)
 
     def closest_node(self, pos):
-        # Just search through the nodes linearly since nodes won't necessarily be laid out in a
-        # grid. Could use a smarter algorithm in the future to prune the search space.
-        for node in self.nodes.values():
-            if node.contains(pos):
-                return node
+        for node in self.closest_nodes(pos):
+            return node
         return None
 
+    # Nodes are keyed by the integer cell they cover, so only the cell pos is in (and the cells on
+    # the other side of any cell border it's on, since nodes include their borders) can contain
+    # it. They're yielded in the order they were added, like scanning every node would.
     def closest_nodes(self, pos):
-        for node in self.nodes.values():
-            if node.contains(pos):
-                yield node
+        xs = self.containing_cells(pos.x)
+        ys = self.containing_cells(pos.y)
+        nodes = [self.nodes[(x, y)] for x in xs for y in ys if (x, y) in self.nodes]
+        if len(nodes) > 1:
+            nodes.sort(key=lambda node: self.node_order[node])
+        return iter(nodes)
+
+    @staticmethod
+    def containing_cells(coordinate):
+        cell = math.floor(coordinate)
+        return (cell - 1, cell) if cell == coordinate else (cell,)
 
     def search(self, start_pos, target_pos):
         start = self.closest_node(start_pos)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+
+PLAN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'portal', 'plans')
+PLAN_CACHE_SIZE = 64 * 1024 * 1024 # bytes
+
+# Stores plans on disk, one JSON file per problem, under a hash of the problem, the domain and
+# whatever planner options could change the plan.
+#
+# Object names in plans are stored canonicalized (see canonicalize), so a cached plan has to be
+# renamed back to the live objects of the problem it's used for. Every hit touches the file, so once
+# the cache is over max_size, dropping the files with the oldest modification times evicts the least
+# recently used plans.
+class PlanCache:
+    def __init__(self, directory=PLAN_CACHE_DIR, max_size=PLAN_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    # Returns the cache key for a serialized problem along with the map from the problem's object
+    # names to their canonical ones
+    def key(self, problem_data, domain_text, options):
+        canonical, names = canonicalize(problem_data)
+        payload = json.dumps([canonical, options], sort_keys=True)
+        digest = hashlib.sha256()
+        digest.update(domain_text.encode())
+        digest.update(payload.encode())
+        return digest.hexdigest(), names
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    # Returns the cached plan, as a list of serialized actions using the names in names, or None
+    # if there isn't one
+    def get(self, key, names):
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                plan = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        live_names = { canonical: name for name, canonical in names.items() }
+        return [[action[0], *[live_names.get(arg, arg) for arg in action[1:]]] for action in plan]
+
+    def put(self, key, names, plan):
+        os.makedirs(self.directory, exist_ok=True)
+        plan = [[action[0], *[names.get(arg, arg) for arg in action[1:]]] for action in plan]
+        # Write to a temporary file and move it into place, so concurrent solvers never see half
+        # written plans
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(plan, f)
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+# Renames a serialized problem's objects by their position in its :objects list, so that the
+# names Object makes up from a global counter don't matter, and sorts its initial facts, which are
+# built from sets. The problem's own name is dropped too. Returns the canonical problem and the map
+# from old names to new ones.
+def canonicalize(problem_data):
+    names = {}
+    for form in problem_data[2:]:
+        if form[0] == ':objects':
+            for i, name in enumerate(form[1::3]):
+                names[name] = 'object%d' % i
+
+    def rename(expr):
+        if isinstance(expr, list):
+            return [rename(e) for e in expr]
+        return names.get(expr, expr)
+
+    canonical = []
+    for form in problem_data[2:]:
+        form = rename(form)
+        if form[0] == ':init':
+            form = [':init', *sorted(form[1:], key=json.dumps)]
+        canonical.append(form)
+    return canonical, names
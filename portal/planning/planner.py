@@ -1,61 +1,164 @@
+import multiprocessing
+import queue
 import requests
 import sexpdata
 
-from planner.domain import Domain
+from planner.domain import domain_source, load_domain
 from planner.problem import Problem
+from planner.search import SearchResult, SearchStatistics
 from portal.planning.actions import actions, Pathfind
 from planner import utils
 
 DOMAIN_PATH = 'pddl/domain.pddl'
+# How long (in seconds) anytime search keeps looking for shorter plans once it has one
+ANYTIME_DEADLINE = 2
 
 class RemotePlanner:
     def __init__(self, problem):
         self.problem = problem
-        with open(DOMAIN_PATH, 'r') as domain_file:
-            self.domain = domain_file.read()
+        self.domain = domain_source(DOMAIN_PATH)
+        # The remote planner doesn't say how its search went, only what it found
+        self.result = None
 
     def plan(self):
+        return self.parse_actions(self.plan_data())
+
+    # Returns the plan as a list of serialized actions (action name followed by argument names)
+    def plan_data(self):
         problem_str = sexpdata.dumps(self.problem.serialize(), str_as='symbol')
         data = { 'domain': self.domain, 'problem': problem_str }
         r = requests.post('http://solver.planning.domains/solve', data=data).json()
         if 'plan' in r['result']:
-            return self.parse_actions(r['result']['plan'])
+            return [utils.desymbolize(sexpdata.loads(action['name']))
+                    for action in r['result']['plan']]
         else:
             print(r['result']['error'])
             raise Exception('planning failed')
 
     def parse_actions(self, action_data):
-        parsed = []
-        for action in action_data:
-            data = utils.desymbolize(sexpdata.loads(action['name']))
-            action_name = data[0]
-            args = [self.problem.objects[arg] for arg in data[1:]]
-            parsed.append(actions[action_name](*args))
-        # Append a final path to the goal
-        parsed.append(Pathfind(self.problem.level.player, self.problem.level.goal))
-        return parsed
+        return self.problem.parse_actions(action_data)
 
 
 class ForwardSearchPlanner:
-    def __init__(self, portal_problem):
+    def __init__(self, portal_problem, search='anytime', heuristic=None, limits=None, cancel=None,
+                 deadline=ANYTIME_DEADLINE):
         self.portal_problem = portal_problem
-        with open(DOMAIN_PATH, 'r') as f:
-            self.domain = Domain.load(f)
-        self.problem = Problem.deserialize(portal_problem.serialize(), self.domain)
+        self.search = search
+        self.heuristic = heuristic
+        self.limits = limits
+        self.cancel = cancel
+        self.deadline = deadline
+        self.result = None
+        self.problem = None
+        self.objects = None
 
     def plan(self):
-        actions = self.problem.plan()
-        if actions is not None:
-            return self.parse_actions([a.serialize() for a in self.problem.plan()])
-        else:
+        self.solve()
+        if self.result.plan is None:
             return None
-
-    def parse_actions(self, action_data):
-        parsed = []
-        for action in action_data:
-            action_name = action[0]
-            args = [self.portal_problem.objects[arg] for arg in action[1:]]
-            parsed.append(actions[action_name](*args))
-        # Append a final path to the goal
+        # The planner's values map straight back to our objects, no need to go through names
+        parsed = [actions[a.action.name](*[self.objects[arg] for arg in a.args])
+                  for a in self.result.plan]
         parsed.append(Pathfind(self.portal_problem.level.player, self.portal_problem.level.goal))
         return parsed
+
+    def solve(self):
+        self.problem, self.objects = self.portal_problem.planner_problem(load_domain(DOMAIN_PATH))
+        deadline = self.deadline if self.search == 'anytime' else None
+        self.result = self.problem.solve(self.search, self.heuristic, limits=self.limits,
+                                         cancel=self.cancel, deadline=deadline)
+
+    # Returns the plan as a list of serialized actions, or None if there isn't one. The full
+    # planner.search.SearchResult (including why the search stopped) is kept in self.result.
+    def plan_data(self):
+        self.solve()
+        actions = self.result.plan
+        return [a.serialize() for a in actions] if actions is not None else None
+
+    def parse_actions(self, action_data):
+        return self.portal_problem.parse_actions(action_data)
+
+
+# Each configuration is a set of keyword arguments for planner.problem.Problem.solve
+PORTFOLIO = [
+    { 'search': 'bfs' },
+    { 'search': 'gbfs', 'heuristic': 'ff' },
+    { 'search': 'astar', 'heuristic': 'max' },
+    { 'search': 'wastar', 'heuristic': 'ff' },
+]
+PORTFOLIO_POLL_INTERVAL = 0.1 # seconds
+
+# Runs each of the configurations in its own process and takes the first plan any of them finds,
+# terminating the rest. limits apply to each process separately. Like ForwardSearchPlanner,
+# self.result keeps the planner.search.SearchResult of the configuration that settled it (with its
+# plan as serialized actions), and self.winner the configuration that found the plan.
+class PortfolioPlanner:
+    def __init__(self, portal_problem, configurations=PORTFOLIO, limits=None, cancel=None):
+        self.portal_problem = portal_problem
+        self.configurations = configurations
+        self.limits = limits
+        self.cancel = cancel
+        self.result = None
+        self.winner = None
+
+    def plan(self):
+        action_data = self.plan_data()
+        return self.parse_actions(action_data) if action_data is not None else None
+
+    def plan_data(self):
+        problem_data = self.portal_problem.serialize()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=solve_configuration,
+                                           args=(i, problem_data, config, self.limits, results),
+                                           daemon=True)
+                   for i, config in enumerate(self.configurations)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            return self.wait_for_plan(workers, results)
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+    # Returns the first plan reported, or None once a configuration proves there isn't one or they
+    # have all given up. self.result is left with the last report.
+    def wait_for_plan(self, workers, results):
+        remaining = set(range(len(workers)))
+        while remaining:
+            if self.cancel is not None and self.cancel.cancelled:
+                self.result = SearchResult(SearchResult.CANCELLED, None, SearchStatistics())
+                return None
+            try:
+                i, status, plan, statistics = results.get(timeout=PORTFOLIO_POLL_INTERVAL)
+            except queue.Empty:
+                # Workers that crashed never report back
+                remaining -= { i for i in remaining if workers[i].exitcode not in (None, 0) }
+                continue
+            remaining.discard(i)
+            if status is None:
+                continue
+            self.result = SearchResult(status, plan, statistics)
+            if plan is not None:
+                self.winner = self.configurations[i]
+                return plan
+            elif status == SearchResult.UNSOLVABLE:
+                return None
+        return None
+
+    def parse_actions(self, action_data):
+        return self.portal_problem.parse_actions(action_data)
+
+# Reports (index, status, plan, statistics) for the configuration, or (index, None, None, None) if
+# it failed
+def solve_configuration(index, problem_data, configuration, limits, results):
+    report = (index, None, None, None)
+    try:
+        problem = Problem.deserialize(problem_data, load_domain(DOMAIN_PATH))
+        result = problem.solve(**configuration, limits=limits)
+        plan = [a.serialize() for a in result.plan] if result.plan is not None else None
+        report = (index, result.status, plan, result.statistics)
+    finally:
+        results.put(report)
@@ -1,6 +1,15 @@
 from portal.planning.predicates import *
 from portal.planning.objects import *
-from portal.planning.planner import ForwardSearchPlanner, RemotePlanner
+from portal.planning.actions import actions, Pathfind
+from planner.domain import domain_source
+from planner.problem import Problem as PlannerProblem
+from planner.search import SearchResult
+from planner.value import Value
+from portal.planning.cache import PlanCache
+from portal.planning.planner import (ANYTIME_DEADLINE, DOMAIN_PATH, ForwardSearchPlanner,
+                                     PortfolioPlanner, RemotePlanner)
+
+PLAN_CACHE = PlanCache()
 
 class Problem:
     def __init__(self, level):
@@ -87,9 +96,72 @@ class Problem:
                 init,
                 goal]
 
-    def solve(self, remote=False):
+    # Builds the same planner.problem.Problem that deserializing our serialization against domain
+    # would, straight from our objects and predicates. Returns it along with a dict from each
+    # Value a plan can mention back to the object it stands for.
+    def planner_problem(self, domain):
+        values = { obj: Value(name, domain.types[obj.type()]) for name, obj in self.objects.items() }
+
+        def instantiate(pred):
+            args = [values[arg] if arg in values else domain.constants[arg.name]
+                    for arg in pred.args]
+            return domain.predicates[pred.predicate.name].instantiate(args)
+
+        problem = PlannerProblem(self.level.name, domain,
+                                 { value.name: value for value in values.values() },
+                                 [instantiate(pred) for pred in self.initial_state()],
+                                 instantiate(self.goal_state()))
+        objects = { value: obj for obj, value in values.items() }
+        # Plans can also refer to the domain's constants, which have the same names as our objects
+        for name, value in domain.constants.items():
+            if name in self.objects:
+                objects[value] = self.objects[name]
+        return problem, objects
+
+    # limits and cancel (see planner.search.SearchLimits and CancellationToken) only apply to the
+    # local planner. By default it runs an anytime search, which returns the shortest plan it
+    # found within deadline seconds of finding the first one. search can also be 'portfolio' to
+    # race several searches in parallel (see PortfolioPlanner). Plans from searches that ran to
+    # completion (or, for anytime search, to the deadline) are stored in cache (unless it's None),
+    # and later solves of the same level with the same options reuse them. Plans from cancelled
+    # or limited searches are returned but not stored, since a full search might do better.
+    def solve(self, remote=False, search='anytime', heuristic=None, limits=None, cancel=None,
+              deadline=ANYTIME_DEADLINE, cache=PLAN_CACHE):
+        if cache is None:
+            return self.planner(remote, search, heuristic, limits, cancel, deadline).plan()
+
+        domain_text = domain_source(DOMAIN_PATH)
+        options = { 'remote': remote, 'search': search, 'heuristic': heuristic }
+        # How long anytime search gets changes which plan it ends up with
+        if search == 'anytime' and not remote:
+            options['deadline'] = deadline
+        key, names = cache.key(self.serialize(), domain_text, options)
+        action_data = cache.get(key, names)
+        if action_data is None:
+            planner = self.planner(remote, search, heuristic, limits, cancel, deadline)
+            action_data = planner.plan_data()
+            if action_data is None:
+                return None
+            if planner.result is None or planner.result.status == SearchResult.SOLVED:
+                cache.put(key, names, action_data)
+        return self.parse_actions(action_data)
+
+    def planner(self, remote, search, heuristic, limits, cancel, deadline):
         if remote:
-            planner = RemotePlanner(self)
+            return RemotePlanner(self)
+        elif search == 'portfolio':
+            return PortfolioPlanner(self, limits=limits, cancel=cancel)
         else:
-            planner = ForwardSearchPlanner(self)
-        return planner.plan()
+            return ForwardSearchPlanner(self, search, heuristic, limits, cancel, deadline)
+
+    # Turns a plan, as a list of serialized actions (action name followed by argument names), into
+    # actions on our objects
+    def parse_actions(self, action_data):
+        parsed = []
+        for action in action_data:
+            action_name = action[0]
+            args = [self.objects[arg] for arg in action[1:]]
+            parsed.append(actions[action_name](*args))
+        # Append a final path to the goal
+        parsed.append(Pathfind(self.level.player, self.level.goal))
+        return parsed
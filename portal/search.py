@@ -22,6 +22,10 @@ class SearchNode:
     def __repr__(self):
         return 'SearchNode[%s]' % self.state
 
+# Counts expanded nodes, generated nodes, duplicates (stale frontier entries for states that were
+# already explored, and neighbors that weren't worth queueing) and the peak frontier size. The
+# explored set peaks at expanded. Like planner.search.ForwardSearch, it has on_expand(node),
+# on_generate(node) and on_solution(path) hooks, which are skipped when None.
 class AStarSearch:
     def __init__(self, start, goal_test, heuristic):
         self.frontier = []
@@ -31,23 +35,41 @@ class AStarSearch:
         self.heuristic = heuristic
         self.goal_test = goal_test
 
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.peak_frontier = 0
+
+        self.on_expand = None
+        self.on_generate = None
+        self.on_solution = None
+
     def search(self):
         heapq.heappush(self.frontier, SearchNode(self.start, self.heuristic(self.start), self.start))
         self.frontier_costs[self.start] = 0
 
         for node in self.explore_nodes():
             if self.goal_test(node.state):
-                return node.history()
+                path = node.history()
+                if self.on_solution is not None:
+                    self.on_solution(path)
+                return path
             self.expand_node(node)
         return None
 
     def explore_nodes(self):
         while self.frontier:
+            self.peak_frontier = max(self.peak_frontier, len(self.frontier))
             node = heapq.heappop(self.frontier)
             if node.state not in self.explored:
                 del self.frontier_costs[node.state]
                 self.explored.add(node.state)
+                self.expanded += 1
+                if self.on_expand is not None:
+                    self.on_expand(node)
                 yield node
+            else:
+                self.duplicates += 1
 
     def expand_node(self, node):
         for neighbor, wall, _ in node.state.neighbors:
@@ -58,10 +80,16 @@ class AStarSearch:
                     # existing node entry. Instead, add another to the priority queue (with lower
                     # priority) and ignore the old one if we run into it later.
                     self.push_node(neighbor, node, path_cost)
+                else:
+                    self.duplicates += 1
 
     def push_node(self, state, parent, path_cost):
-        heapq.heappush(self.frontier, SearchNode(state, self.heuristic(state), parent, path_cost))
+        node = SearchNode(state, self.heuristic(state), parent, path_cost)
+        heapq.heappush(self.frontier, node)
         self.frontier_costs[state] = path_cost
+        self.generated += 1
+        if self.on_generate is not None:
+            self.on_generate(node)
 
     def can_explore(self, state, path_cost):
         return (state not in self.explored and
@@ -1,5 +1,5 @@
 from portal import colors
-from portal.geometry import Position
+from portal.geometry import Position, SegmentArrays
 from portal.wall import Wall, PortalWall, Ledge, Door, Grill
 from portal.entity import Portal, Cube, Button
 
@@ -259,10 +259,7 @@ class EraserTool(Tool):
             self.level.remove_entity(e)
 
     def _remove_walls(self, x1, y1, x2, y2):
-        to_remove = []
-        for wall in self.level.walls:
-            if wall.intersects(Position(x1, y1), Position(x2, y2)):
-                to_remove.append(wall)
+        to_remove = SegmentArrays(self.level.walls).intersecting(Position(x1, y1), Position(x2, y2))
         for wall in to_remove:
             self.level.walls.remove(wall)
 
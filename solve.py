@@ -3,6 +3,8 @@ import sys
 
 from portal.animate import ActionSequence
 from portal.level import Level
+from portal.planning.planner import ANYTIME_DEADLINE
+from portal.planning.problem import PLAN_CACHE
 from view import LevelView
 
 if __name__ == '__main__':
@@ -12,11 +14,40 @@ if __name__ == '__main__':
         remote = True
         args.remove('-r')
 
+    cache = PLAN_CACHE
+    if '-n' in args:
+        cache = None
+        args.remove('-n')
+
+    search = 'anytime'
+    if '-s' in args:
+        i = args.index('-s')
+        search = args[i + 1]
+        del args[i:i + 2]
+
+    heuristic = None
+    if '-H' in args:
+        i = args.index('-H')
+        heuristic = args[i + 1]
+        del args[i:i + 2]
+
+    deadline = ANYTIME_DEADLINE
+    if '-d' in args:
+        i = args.index('-d')
+        deadline = float(args[i + 1])
+        del args[i:i + 2]
+
+    broad_phase = 'grid'
+    if '-b' in args:
+        i = args.index('-b')
+        broad_phase = args[i + 1]
+        del args[i:i + 2]
+
     filename = args[1]
     with open(filename, 'r') as f:
-        level = Level.load(f)
+        level = Level.load(f, broad_phase)
     problem = level.planning_problem()
-    plan = problem.solve(remote)
+    plan = problem.solve(remote, search, heuristic, deadline=deadline, cache=cache)
 
     view = LevelView(level, ActionSequence(level, plan),
                      width=800, height=580)